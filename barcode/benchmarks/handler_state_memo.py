@@ -0,0 +1,88 @@
+"""Micro-benchmark of the handler's memoized state reads (user-028).
+
+Applies n consecutive updates to one item against an in-memory context,
+starting from records of 5, 50 and 500 hops, two ways:
+
+  before  read and parse the record twice per update, nothing cached
+          (what apply did before the state cache)
+  after   one read, parsed record served from the LRU keyed by the state
+          bytes, the written record put back into it
+
+Needs the package and the processor's dependencies installed (pip install -e .):
+
+    python benchmarks/handler_state_memo.py [-n 2000] [--hops 5 50 500]
+"""
+import argparse
+import timeit
+
+from sawtooth_barcode.barcode_codec import append_location
+from sawtooth_barcode.barcode_codec import serialize_state_data
+from sawtooth_barcode.cache import LRUCache
+from sawtooth_barcode.processor.barcode_handler import _get_state_data
+from sawtooth_barcode.processor.barcode_handler import _make_xo_address
+from sawtooth_barcode.processor.barcode_handler import _store_state_data
+
+PREFIX = 'abcdef'
+BARCODE = '4006381333931'
+
+
+class _Entry(object):
+
+    def __init__(self, address, data):
+        self.address = address
+        self.data = data
+
+
+class _MemoryContext(object):
+
+    def __init__(self):
+        self.state = {}
+
+    def get_state(self, addresses, timeout=None):
+        return [_Entry(address, self.state[address]) for address in addresses if address in self.state]
+
+    def set_state(self, entries, timeout=None):
+        self.state.update(entries)
+        return list(entries)
+
+
+def _context(hops):
+    context = _MemoryContext()
+    location = 'Factory' + ''.join('-> Depot{}'.format(i) for i in range(hops))
+    context.set_state({_make_xo_address(PREFIX, BARCODE):
+                       serialize_state_data({BARCODE: ('Widget', '2018-01-01', location)})})
+    return context
+
+
+def run_before(n, hops):
+    context = _context(hops)
+    for _ in range(n):
+        _get_state_data(context, PREFIX, BARCODE)
+        _, _, _, barcode_list = _get_state_data(context, PREFIX, BARCODE)
+        _store_state_data(context, append_location(barcode_list, 'Hop'), PREFIX, BARCODE)
+
+
+def run_after(n, hops):
+    context = _context(hops)
+    cache = LRUCache(maxsize=4096)
+    for _ in range(n):
+        _, _, _, barcode_list = _get_state_data(context, PREFIX, BARCODE, cache=cache)
+        _store_state_data(context, append_location(barcode_list, 'Hop'), PREFIX, BARCODE, cache=cache)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-n', type=int, default=2000, help='updates per run')
+    parser.add_argument('--hops', type=int, nargs='+', default=[5, 50, 500], help='hops in the starting record')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the fastest counts')
+    opts = parser.parse_args()
+
+    for hops in opts.hops:
+        before = min(timeit.repeat(lambda: run_before(opts.n, hops), number=1, repeat=opts.repeat))
+        after = min(timeit.repeat(lambda: run_after(opts.n, hops), number=1, repeat=opts.repeat))
+        print('{:>4} hops: before {:.1f} us/txn, after {:.1f} us/txn, {:.2f}x'.format(
+            hops, before / opts.n * 1e6, after / opts.n * 1e6, before / after))
+
+
+if __name__ == '__main__':
+    main()
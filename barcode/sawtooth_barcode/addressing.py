@@ -0,0 +1,98 @@
+"""State address layout of the barcode family.
+
+Barcode and user records live at prefix + sha512(name)[:64]. Role records
+are kept apart under their own sub-namespace, keyed by signer public key,
+so the processor can read and cache them without touching item records.
+The provenance head of each barcode (see provenance.py) has a sub-namespace
+of its own as well.
+
+Every tenant is a transaction family of its own, 'barcode-<tenant>' with
+prefix sha512(family)[:6], so the validator routes each tenant to the
+processors registered for it. The default tenant keeps the original
+'barcode' family and prefix.
+"""
+import hashlib
+import re
+
+DEFAULT_TENANT = 'default'
+BASE_FAMILY_NAME = 'barcode'
+
+ROLE_SUBSPACE = hashlib.sha512('roles'.encode('utf-8')).hexdigest()[0:4]
+HEAD_SUBSPACE = hashlib.sha512('heads'.encode('utf-8')).hexdigest()[0:4]
+
+# actions that record hops and so advance the provenance head
+HOP_ACTIONS = ('create', 'update', 'move')
+
+
+def _sha512(data):
+    return hashlib.sha512(data).hexdigest()
+
+
+def tenant_family(tenant=None):
+    if not tenant or tenant == DEFAULT_TENANT:
+        return BASE_FAMILY_NAME
+    if not re.match('^[a-z0-9][a-z0-9_]*$', tenant):
+        raise ValueError('Invalid tenant name: {}'.format(tenant))
+    return '{}-{}'.format(BASE_FAMILY_NAME, tenant)
+
+
+def family_tenant(family_name):
+    """Inverse of tenant_family()."""
+    if family_name == BASE_FAMILY_NAME:
+        return DEFAULT_TENANT
+    if not family_name.startswith(BASE_FAMILY_NAME + '-'):
+        raise ValueError('Not a barcode family: {}'.format(family_name))
+    return family_name[len(BASE_FAMILY_NAME) + 1:]
+
+
+def is_barcode_family(family_name):
+    """True for 'barcode' and every tenant's 'barcode-<tenant>'."""
+    return family_name == BASE_FAMILY_NAME or family_name.startswith(BASE_FAMILY_NAME + '-')
+
+
+def family_prefix(family_name):
+    return _sha512(family_name.encode('utf-8'))[0:6]
+
+
+def tenant_prefix(tenant=None):
+    return family_prefix(tenant_family(tenant))
+
+
+def make_barcode_address(prefix, name):
+    return prefix + _sha512(name.encode('utf-8'))[0:64]
+
+
+def role_namespace(prefix):
+    return prefix + ROLE_SUBSPACE
+
+
+def make_role_address(prefix, public_key):
+    return role_namespace(prefix) + _sha512(public_key.encode('utf-8'))[0:60]
+
+
+def make_role_registry_address(prefix):
+    # marks that the first admin has been registered
+    return role_namespace(prefix) + '0' * 60
+
+
+def make_head_address(prefix, name):
+    return prefix + HEAD_SUBSPACE + _sha512(name.encode('utf-8'))[0:60]
+
+
+def transaction_addresses(prefix, name, action):
+    """Returns the (inputs, outputs) a transaction on name has to declare.
+
+    Every action reads the signer's role; only adding a user writes roles,
+    and it reads the user record 'admin' that tells a chain set up before
+    role records existed from a new one. Recording hops reads and writes the
+    barcode's provenance head.
+    """
+    address = make_barcode_address(prefix, name)
+    if action == 'add':
+        setup_address = make_barcode_address(prefix, 'admin')
+        inputs = [address] + ([setup_address] if setup_address != address else []) + [role_namespace(prefix)]
+        return inputs, [address, role_namespace(prefix)]
+    if action in HOP_ACTIONS:
+        head_address = make_head_address(prefix, name)
+        return [address, head_address, role_namespace(prefix)], [address, head_address]
+    return [address, role_namespace(prefix)], [address]
@@ -3,11 +3,18 @@
 """BarCodeReaderCli.
 
 Usage:
-  barcode_cli setup
-  barcode_cli add (supplier|admin) <name> [-k <keypath> | --keypath <keypath>]
-  barcode_cli create chain (-u <user> | --username <user>) [-b <barcode> | --barcode <barcode>]
-  barcode_cli show chain (-u <user> | --username <user>) [-b <barcode> | --barcode <barcode>]
-  barcode_cli update chain (-u <user> | --username <user>) (-l <location> | --location <location>) [-b <barcode> | --barcode <barcode>]
+  barcode_cli setup [--tenant <name>]
+  barcode_cli add (supplier|admin) <name> [-k <keypath> | --keypath <keypath>] [--tenant <name>]
+  barcode_cli migrate (-u <user> | --username <user>) [--tenant <name>]
+  barcode_cli create chain (-u <user> | --username <user>) [-b <barcode> | --barcode <barcode>] [--tenant <name>]
+  barcode_cli show chain (-u <user> | --username <user>) [-b <barcode> | --barcode <barcode>] [--at <point>] [--tenant <name>]
+  barcode_cli update chain (-u <user> | --username <user>) (-l <location> | --location <location>) [-b <barcode> | --barcode <barcode>] [--spool <file>] [--tenant <name>]
+  barcode_cli station (-u <user> | --username <user>) (-l <location> | --location <location>) (--camera <device> | --image <file>)... [--window <seconds>] [--spool <file>] [--tenant <name>]
+  barcode_cli spool (status | drain) [--spool <file>]
+  barcode_cli export [(-u <user> | --username <user>)] (-o <file> | --output <file>) [--format <format>] [--row-group-size <n>] [--tenant <name>]
+  barcode_cli import catalog [(-u <user> | --username <user>)] [--dsn <dsn>] [--checkpoint <file>] [--chunk-size <n>] [--batch-size <n>] [--in-flight <n>] [--workers <n>] [--tenant <name>]
+  barcode_cli verify chain (-b <barcode> | --barcode <barcode>) (--history <file>) [--tenant <name>]
+  barcode_cli watch [-b <barcode> | --barcode <barcode>] [--validator <url>] [--tenant <name>]
   barcode_cli (-h | --help)
   barcode_cli --version
 
@@ -16,8 +23,29 @@ Options:
   -u --username username
   -l --location updating location
   -b --barcode  input barcode through cli
+  --at <point>  show chain as of a block number or a date/time (2018-07-21T10:30:00)
+  --camera <device>   video device of one station camera, repeat for every camera
+  --image <file>      image file standing in for a camera, repeat for several
+  --window <seconds>  how long the station collects scans into one batch [default: 0.5]
+  -o --output <file>  export destination
+  --format <format>   export format, csv or parquet [default: csv]
+  --row-group-size <n>  rows buffered per export row group [default: 65536]
+  --dsn <dsn>         postgres catalog to import [default: dbname=barcode user=barcode_user password=shroot12]
+  --checkpoint <file>  import progress file (default ~/.sawtooth/<family>_import.checkpoint, one per tenant)
+  --chunk-size <n>    rows fetched from the catalog per round trip [default: 1000]
+  --batch-size <n>    create transactions per batch [default: 100]
+  --in-flight <n>     batch lists submitted concurrently [default: 4]
+  --workers <n>       sign transactions across n processes (default: sign on the calling thread)
+  --validator <url>  validator event endpoint [default: tcp://127.0.0.1:4004]
+  --tenant <name>     tenant whose namespace to use (default: 'tenant' in ~/.sawtooth/barcode.yaml, else the shared one)
+  --history <file>    claimed hops, a YAML list of {location, signer, timestamp} in order
+  --spool <file>      local queue of signed batches awaiting the validator (default ~/.sawtooth/barcode_spool.db)
   --version     display version
 
+Upgrading a chain set up before the processor kept role records: every
+registered user, 'admin' first, runs 'barcode_cli migrate -u <user>' once.
+Until then the processor rejects that user's transactions.
+
 """
 
 from __future__ import print_function
@@ -32,13 +60,42 @@ from base64 import b64encode
 import requests
 import yaml
 from docopt import docopt
-from sawtooth_sdk.protobuf.batch_pb2 import Batch
-from sawtooth_sdk.protobuf.batch_pb2 import BatchHeader
 from sawtooth_sdk.protobuf.batch_pb2 import BatchList
-from sawtooth_sdk.protobuf.transaction_pb2 import Transaction
-from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
 
 from sawtooth_barcode.barcode_reader import BarcodeReader
+from sawtooth_barcode.addressing import family_tenant
+from sawtooth_barcode.addressing import make_head_address
+from sawtooth_barcode.addressing import tenant_family
+from sawtooth_barcode.addressing import tenant_prefix
+from sawtooth_barcode.addressing import transaction_addresses
+from sawtooth_barcode.barcode_codec import append_location
+from sawtooth_barcode.barcode_codec import encode_hops
+from sawtooth_barcode.barcode_codec import format_locations
+from sawtooth_barcode.barcode_codec import parse_state_data
+from sawtooth_barcode.barcode_codec import serialize_state_data
+from sawtooth_barcode.bulk_signer import BulkSigner
+from sawtooth_barcode.catalog_import import CatalogImporter
+from sawtooth_barcode.events import BarcodeEventSubscriber
+from sawtooth_barcode.export import export_state
+from sawtooth_barcode.history import BlockIndex
+from sawtooth_barcode.history import StateArchive
+from sawtooth_barcode.provenance import parse_head
+from sawtooth_barcode.provenance import verify_history
+from sawtooth_barcode.provenance import verify_inclusion
+from sawtooth_barcode.rate_control import QueueFullError
+from sawtooth_barcode.rate_control import RateController
+from sawtooth_barcode.rate_control import backoff_delay
+from sawtooth_barcode.spool import BatchRefusedError
+from sawtooth_barcode.spool import BatchSpool
+from sawtooth_barcode.spool import ConnectionFailedError
+from sawtooth_barcode.spool import SpoolDrainer
+from sawtooth_barcode.state_cache import shared_state_cache
+from sawtooth_barcode.station import CameraSource
+from sawtooth_barcode.station import FileSource
+from sawtooth_barcode.station import ScanStation
+from sawtooth_barcode.txn_builder import make_batch
+from sawtooth_barcode.txn_builder import make_payload
+from sawtooth_barcode.txn_builder import make_transaction
 from sawtooth_signing import CryptoFactory
 from sawtooth_signing import ParseError
 from sawtooth_signing import create_context
@@ -47,17 +104,40 @@ from sawtooth_signing.secp256k1 import Secp256k1PublicKey
 
 DISTRIBUTION_NAME = 'sawtooth-barcode'
 DEFAULT_URL = 'http://127.0.0.1:8008'
+CLIENT_CONFIG_FILE = os.path.join(os.path.expanduser('~'), '.sawtooth', 'barcode.yaml')
+
+
+class NoSuchNameError(Exception):
+    pass
 
 
 def _sha512(data):
     return hashlib.sha512(data).hexdigest()
 
 
+def _decode_barcode_data(data, b_id):
+    return parse_state_data(data)[re.sub("^0+", "", b_id)]
+
+
+def load_client_config(path=CLIENT_CONFIG_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fd:
+        return yaml.safe_load(fd) or {}
+
+
 class BarcodeClient:
 
-    def __init__(self, base_url, keyfile=None):
+    def __init__(self, base_url, keyfile=None, rate_controller=None, max_retries=8, state_cache=None, spool=None,
+                 tenant=None):
 
         self._base_url = base_url
+        self._family_name = tenant_family(tenant)
+        self._prefix = tenant_prefix(tenant)
+        self._spool = spool
+        self._state_cache = state_cache if state_cache is not None else shared_state_cache(base_url)
+        self._rate_controller = rate_controller if rate_controller is not None else RateController()
+        self._max_retries = max_retries
         if keyfile is None:
             self._signer = None
             return
@@ -76,30 +156,28 @@ class BarcodeClient:
 
         self._signer = CryptoFactory(create_context('secp256k1')).new_signer(self.private_key)
 
-    @staticmethod
-    def _get_prefix():
-        return _sha512('barcode'.encode('utf-8'))[0:6]
+    def _get_prefix(self):
+        return self._prefix
 
     def _get_address(self, name):
         barcode_prefix = self._get_prefix()
         name_address = _sha512(name.encode('utf-8'))[0:64]
         return barcode_prefix + name_address
 
-    def _create_batch_list(self, transactions):
-        transaction_signatures = [t.header_signature for t in transactions]
+    def _create_batch(self, transactions):
+        return make_batch(self._signer, transactions)
 
-        header = BatchHeader(
-            signer_public_key=self._signer.get_public_key().as_hex(),
-            transaction_ids=transaction_signatures
-        ).SerializeToString()
+    def _create_batch_list(self, transactions):
+        return BatchList(batches=[self._create_batch(transactions)])
 
-        signature = self._signer.sign(header)
+    def bulk_signer(self, workers=None):
+        return BulkSigner(self.private_key.as_hex(), self._get_prefix(), workers=workers, family_name=self._family_name)
 
-        batch = Batch(
-            header=header,
-            transactions=transactions,
-            header_signature=signature)
-        return BatchList(batches=[batch])
+    def build_batch_lists(self, txn_specs, txns_per_batch=100, batches_per_list=10, workers=None):
+        with self.bulk_signer(workers=workers) as signer:
+            batch_lists = signer.build_batch_lists(txn_specs, txns_per_batch=txns_per_batch,
+                                                   batches_per_list=batches_per_list)
+        return batch_lists, signer.stats
 
     def _send_request(self, suffix, data=None, content_type=None, name=None, auth_user=None, auth_password=None):
         if self._base_url.startswith("http://"):
@@ -124,19 +202,54 @@ class BarcodeClient:
                 result = requests.get(url, headers=headers)
 
             if result.status_code == 404:
-                raise Exception("No such name: {}".format(name))
+                raise NoSuchNameError("No such name: {}".format(name))
+
+            elif result.status_code == 429:
+                raise QueueFullError("Validator queue full: {}".format(result.reason))
+
+            elif 400 <= result.status_code < 500:
+                raise BatchRefusedError("Error {}: {}".format(result.status_code, result.reason))
 
             elif not result.ok:
                 raise Exception("Error {}: {}".format(result.status_code, result.reason))
 
-        except requests.ConnectionError as err:
-            raise Exception('Failed to connect to {}: {}'.format(url, str(err)))
+        except (requests.ConnectionError, requests.Timeout) as err:
+            raise ConnectionFailedError('Failed to connect to {}: {}'.format(url, str(err)))
+
+        except (QueueFullError, NoSuchNameError, ConnectionFailedError, BatchRefusedError):
+            raise
 
         except BaseException as err:
             raise Exception(err)
 
         return result.text
 
+    @property
+    def rate(self):
+        return self._rate_controller.rate
+
+    @property
+    def queue_full_count(self):
+        return self._rate_controller.queue_full_count
+
+    def _submit_batches(self, data, auth_user=None, auth_password=None):
+        # data is the already signed BatchList, so a retry resubmits the very same batch ids
+        attempt = 0
+        while True:
+            self._rate_controller.acquire()
+            try:
+                response = self._send_request("batches", data, 'application/octet-stream',
+                                              auth_user=auth_user, auth_password=auth_password)
+            except QueueFullError:
+                self._rate_controller.on_queue_full()
+                if attempt >= self._max_retries:
+                    raise
+                time.sleep(backoff_delay(attempt))
+                attempt += 1
+                continue
+            self._rate_controller.on_success()
+            return response
+
     def _get_status(self, batch_id, wait, auth_user=None, auth_password=None):
         try:
             result = self._send_request(
@@ -147,27 +260,22 @@ class BarcodeClient:
         except BaseException as err:
             raise Exception(err)
 
-    def _send_barcode_txn(self, name, action, location="", wait=None, auth_user=None, auth_password=None):
-        # Serialization is just a delimited utf-8 encoded string
-        payload = ",".join([name, action, location]).encode()
-
-        # Construct the address
-        address = self._get_address(name)
-
-        header = TransactionHeader(signer_public_key=self._signer.get_public_key().as_hex(), family_name="barcode",
-                                   family_version="1.0", inputs=[address], outputs=[address], dependencies=[],
-                                   payload_sha512=_sha512(payload),
-                                   batcher_public_key=self._signer.get_public_key().as_hex(),
-                                   nonce=time.time().hex().encode()).SerializeToString()
-        signature = self._signer.sign(header)
-        transaction = Transaction(header=header, payload=payload, header_signature=signature)
-        batch_list = self._create_batch_list([transaction])
-        batch_id = batch_list.batches[0].header_signature
+    def _create_transaction(self, name, action, location="", dependencies=None):
+        # Construct the addresses
+        inputs, outputs = transaction_addresses(self._get_prefix(), name, action)
+        return make_transaction(self._signer, make_payload(name, action, location), inputs=inputs,
+                                outputs=outputs, dependencies=dependencies, family_name=self._family_name)
+
+    def _create_move_transaction(self, name, hops, dependencies=None):
+        return self._create_transaction(name, 'move', encode_hops(hops), dependencies=dependencies)
+
+    def send_batch_list(self, batch_list, wait=None, auth_user=None, auth_password=None):
+        batch_id = batch_list.batches[-1].header_signature
         if wait and wait > 0:
             wait_time = 0
             start_time = time.time()
-            response = self._send_request("batches", batch_list.SerializeToString(), 'application/octet-stream',
-                                          auth_user=auth_user, auth_password=auth_password)
+            response = self._submit_batches(batch_list.SerializeToString(), auth_user=auth_user,
+                                            auth_password=auth_password)
             while wait_time < wait:
                 status = self._get_status(batch_id, wait - int(wait_time), auth_user=auth_user,
                                           auth_password=auth_password)
@@ -176,26 +284,136 @@ class BarcodeClient:
                     return response
             return response
 
-        return self._send_request("batches", batch_list.SerializeToString(), 'application/octet-stream',
-                                  auth_user=auth_user, auth_password=auth_password)
+        return self._submit_batches(batch_list.SerializeToString(), auth_user=auth_user, auth_password=auth_password)
+
+    def get_batch_statuses(self, batch_ids, wait, auth_user=None, auth_password=None):
+        result = self._send_request('batch_statuses?id={}&wait={}'.format(','.join(batch_ids), wait),
+                                    auth_user=auth_user, auth_password=auth_password)
+        return {entry['id']: entry['status'] for entry in yaml.safe_load(result)['data']}
+
+    def _send_barcode_txn(self, name, action, location="", wait=None, auth_user=None, auth_password=None):
+        transaction = self._create_transaction(name, action, location)
+        batch_list = self._create_batch_list([transaction])
+        return self.send_batch_list(batch_list, wait=wait, auth_user=auth_user, auth_password=auth_password)
 
     def create(self, b_id, wait=None, auth_user=None, auth_password=None):
         return self._send_barcode_txn(b_id, "create", wait=wait, auth_user=auth_user, auth_password=auth_password)
 
-    def show(self, b_id, auth_user=None, auth_password=None):
+    def _read_state(self, address, head=None, name=None, auth_user=None, auth_password=None):
+        # without a known head the read goes out unpinned and the answer names the head it was served at
+        if head is None:
+            head = self._state_cache.fresh_head()
+        if head is not None:
+            cached = self._state_cache.get(address, head)
+            if cached is not None:
+                return cached[0]
 
-        address = self._get_address(b_id)
-        result = self._send_request("state/{}".format(address), name=b_id, auth_user=auth_user,
-                                    auth_password=auth_password)
+        suffix = "state/{}?head={}".format(address, head) if head is not None else "state/{}".format(address)
         try:
-            return base64.b64decode(yaml.safe_load(result)["data"])
+            result = self._send_request(suffix, name=name, auth_user=auth_user, auth_password=auth_password)
+        except NoSuchNameError:
+            data = None
+        else:
+            try:
+                response = yaml.safe_load(result)
+                data = base64.b64decode(response["data"])
+            except BaseException:
+                return None
+            if head is None:
+                head = response.get("head")
+                if head is not None:
+                    self._state_cache.set_head(head)
+        if head is not None:
+            self._state_cache.put(address, head, (data,))
+        return data
+
+    def show(self, b_id, head=None, auth_user=None, auth_password=None):
+        # None only when nothing is stored for b_id; failing to reach the REST API raises
+        address = self._get_address(b_id)
+        if head is None:
+            pending = self._state_cache.overlay(self, address)
+            if pending is not None:
+                return pending
 
-        except BaseException:
-            return None
+        return self._read_state(address, head, name=b_id, auth_user=auth_user, auth_password=auth_password)
+
+    def provenance_head(self, b_id, auth_user=None, auth_password=None):
+        """Returns (digest, hop count) of the barcode's committed provenance chain."""
+        address = make_head_address(self._get_prefix(), b_id)
+        return parse_head(self._read_state(address, name=b_id, auth_user=auth_user, auth_password=auth_password))
+
+    def verify_history(self, b_id, hops, auth_user=None, auth_password=None):
+        """Checks a claimed history [(location, signer, timestamp), ...] against the committed head."""
+        digest, count = self.provenance_head(b_id, auth_user=auth_user, auth_password=auth_password)
+        return verify_history(hops, digest, count)
+
+    def verify_inclusion(self, b_id, previous_digest, hop, following_hops, auth_user=None, auth_password=None):
+        digest, _ = self.provenance_head(b_id, auth_user=auth_user, auth_password=auth_password)
+        return verify_inclusion(previous_digest, hop, following_hops, digest)
+
+    def show_at(self, b_id, at, auth_user=None, auth_password=None):
+        block_id = BlockIndex(self).resolve(at)
+        address = self._get_address(b_id)
+        archive = StateArchive()
+        found, data = archive.get(address, block_id)
+        if not found:
+            data = self._read_state(address, block_id, name=b_id, auth_user=auth_user, auth_password=auth_password)
+            archive.put(address, block_id, data)
+        return block_id, _decode_barcode_data(data, b_id) if data is not None else None
+
+    def _overlay_hops(self, b_id, hops, batch_id):
+        # predict the state our updates produce, so our own reads see it before it is committed
+        address = self._get_address(b_id)
+        current = self._state_cache.pending_or_latest(address)
+        if current is None:
+            return
+        try:
+            barcode_list = parse_state_data(current)
+        except ValueError:
+            return
+        for location, timestamp in hops:
+            barcode_list = append_location(barcode_list, location, timestamp)
+        self._state_cache.add_overlay(address, batch_id, serialize_state_data(barcode_list))
 
     def update(self, b_id, location, wait=None, auth_user=None, auth_password=None):
-        return self._send_barcode_txn(b_id, "update", location=location, wait=wait, auth_user=auth_user,
-                                      auth_password=auth_password)
+        return self.update_many([b_id], location, wait=wait, auth_user=auth_user, auth_password=auth_password)
+
+    def _hop_transaction(self, b_id, hops, dependencies=None):
+        if len(hops) == 1:
+            return self._create_transaction(b_id, 'update', hops[0][0], dependencies=dependencies)
+        return self._create_move_transaction(b_id, hops, dependencies=dependencies)
+
+    def _spool_hops(self, b_id_hops):
+        # written to disk first, SpoolDrainer or BatchSpool.drain() submits it
+        with self._spool.lock:
+            batches = []
+            for b_id, hops in b_id_hops:
+                previous = self._spool.last_transaction(self._family_name, b_id)
+                transaction = self._hop_transaction(b_id, hops, dependencies=[previous] if previous else None)
+                batches.append((self._create_batch([transaction]), {b_id: transaction.header_signature}))
+            self._spool.append_many(self._family_name, batches)
+        for (b_id, hops), (batch, _) in zip(b_id_hops, batches):
+            self._overlay_hops(b_id, hops, batch.header_signature)
+        return [batch.header_signature for batch, _ in batches]
+
+    def _send_hops(self, b_id_hops, wait=None, auth_user=None, auth_password=None):
+        # a batch per barcode, so one unknown barcode only fails its own hops; still one POST
+        if self._spool is not None:
+            return self._spool_hops(b_id_hops)
+        batch_list = BatchList(batches=[self._create_batch([self._hop_transaction(b_id, hops)])
+                                        for b_id, hops in b_id_hops])
+        response = self.send_batch_list(batch_list, wait=wait, auth_user=auth_user, auth_password=auth_password)
+        for (b_id, hops), batch in zip(b_id_hops, batch_list.batches):
+            self._overlay_hops(b_id, hops, batch.header_signature)
+        return response
+
+    def update_many(self, b_ids, location, wait=None, auth_user=None, auth_password=None):
+        return self._send_hops([(b_id, [(location, time.time())]) for b_id in b_ids], wait=wait,
+                               auth_user=auth_user, auth_password=auth_password)
+
+    def move(self, b_id, hops, wait=None, auth_user=None, auth_password=None):
+        """Records several hops [(location, timestamp), ...] of one barcode in a single transaction."""
+        return self._send_hops([(b_id, hops)], wait=wait, auth_user=auth_user, auth_password=auth_password)
 
     def add_priv_key(self, user, keypath, tag,  wait=None, auth_user=None, auth_password=None):
 
@@ -211,10 +429,14 @@ class BarcodeClient:
 
 class BarcodeOperations(object):
 
-    def __init__(self, user):
+    def __init__(self, user, tenant=None):
         self.user = user
+        self.tenant = tenant
         self.key_file = None
 
+    def _client(self, **kwargs):
+        return BarcodeClient(base_url=DEFAULT_URL, tenant=self.tenant, **kwargs)
+
     def _get_key_file(self, user=None):
         user = self.user if user is None else user
         home = os.path.expanduser("~")
@@ -245,12 +467,14 @@ class BarcodeOperations(object):
         else:
             raise Exception('Unable to find public kye {key} of user {user}'.format(key=pub_key_file, user=self.user))
 
-        username, tag, priv_key = self._get_user_from_block_chain()
+        user_record = self._get_user_from_block_chain()
+        if user_record is None:
+            raise Exception('User {user} is not registered on the block chain'.format(user=self.user))
+        username, tag, priv_key = user_record
         private_key = Secp256k1PrivateKey.from_hex(priv_key)
         public_key = Secp256k1PublicKey(private_key.secp256k1_private_key.pubkey)
 
         if self.pub_key_str == public_key.as_hex():
-            import pdb;pdb.set_trace()
             if restrict and tag != 'admin':
                 raise Exception('Only Admin type users are allowed to perform these operations')
             print('Validation successful')
@@ -260,11 +484,11 @@ class BarcodeOperations(object):
             'Should have correct public keyfile {file} to create user'.format(file=pub_key_file))
 
     def _get_user_from_block_chain(self):
-        client = BarcodeClient(base_url=DEFAULT_URL, keyfile=self.key_file)
+        client = self._client(keyfile=self.key_file)
         data = client.show(self.user)
         if data is not None:
-            username, tag_priv_key = data.decode().split('|')
-            tag, priv_key = tag_priv_key.split(':')
+            # the handler stores users as name|tag|private key
+            username, tag, priv_key = data.decode().split('|')
         else:
             return None
 
@@ -273,7 +497,7 @@ class BarcodeOperations(object):
     def create_chain(self, b_id=None):
 
         self._validate_user(restrict=True)
-        client = BarcodeClient(base_url=DEFAULT_URL, keyfile=self.key_file)
+        client = self._client(keyfile=self.key_file)
         if b_id is None:
             read_barcode = BarcodeReader()
             b_id = read_barcode.read_barcode_by_cam()
@@ -284,44 +508,126 @@ class BarcodeOperations(object):
         else:
             print('INFO: Unable to read barcode')
 
-    def show_chain(self, b_id=None):
+    def show_chain(self, b_id=None, at=None):
         self._validate_user()
-        client = BarcodeClient(base_url=DEFAULT_URL, keyfile=self.key_file)
+        client = self._client(keyfile=self.key_file)
         read_barcode = BarcodeReader()
         if b_id is None:
             b_id = read_barcode.read_barcode_by_cam()
         if b_id:
             print('INFO: Barcode read: {}'.format(b_id))
-            data = client.show(b_id)
-            if data is not None:
-                product_name, mfg_date, location = {
-                    b_id: (product_name, mfg_date, location) for b_id, product_name, mfg_date, location in
-                    [barcode.split(',') for barcode in data.decode().split('|')]}[re.sub("^0+", "", b_id)]
+            if at is None:
+                data = client.show(b_id)
+                record = _decode_barcode_data(data, b_id) if data is not None else None
+            else:
+                block_id, record = client.show_at(b_id, at)
+                print('INFO: State as of block {}'.format(block_id))
+            if record is not None:
+                product_name, mfg_date, location = record
                 print("\n")
                 print("\n")
                 print("Barcode Number:      {}".format(b_id))
                 print("Product Name:        {}".format(product_name))
                 print("Manufacturing Date:  {}".format(mfg_date))
-                print("Locations Crossed:   {}".format(location))
+                print("Locations Crossed:   {}".format(format_locations(location)))
                 print("\n")
             else:
                 print('Barcode not Found')
         else:
             print('INFO: Unable to read barcode')
 
-    def update_chain(self, location, b_id=None):
+    def update_chain(self, location, b_id=None, spool_path=None):
         self._validate_user()
-        client = BarcodeClient(base_url=DEFAULT_URL, keyfile=self.key_file)
+        spool = BatchSpool(spool_path)
+        client = self._client(keyfile=self.key_file, spool=spool)
         read_barcode = BarcodeReader()
         if b_id is None:
             b_id = read_barcode.read_barcode_by_cam()
         if b_id:
             print('INFO: Barcode read: {}'.format(b_id))
-            response = client.update(b_id, location)
-            print("Response: {}".format(response))
+            batch_id, = client.update(b_id, location)
+            try:
+                submitted, _ = spool.drain(client)
+                print('INFO: Update {} submitted with {} spooled batches'.format(batch_id, submitted))
+            except (ConnectionFailedError, QueueFullError) as e:
+                print('INFO: Validator unavailable ({}), update {} kept in {}'.format(e, batch_id, spool.path))
         else:
             print('INFO: Unable to read barcode')
 
+    def run_station(self, location, cameras, images, window=0.5, spool_path=None):
+        self._validate_user()
+        spool = BatchSpool(spool_path)
+        client = self._client(keyfile=self.key_file, spool=spool)
+
+        def submit(b_ids):
+            client.update_many(b_ids, location)
+            print('INFO: {} barcodes moved to {}: spooled'.format(len(b_ids), location))
+
+        sources = [CameraSource(cam_name) for cam_name in cameras] + [FileSource([path]) for path in images]
+        station = ScanStation(sources, submit, window=window)
+        # scans only ever wait for the local disk, the drainer deals with the network
+        drainer = SpoolDrainer(spool, client).start()
+        station.start()
+        print('INFO: Scanning with {} sources, Ctrl-C to stop'.format(len(sources)))
+        try:
+            station.wait()
+        finally:
+            station.stop()
+            drainer.stop()
+            print('INFO: {} barcodes submitted, {} duplicate scans dropped, {} failed scans given up'.format(
+                station.submitted, station.queue.duplicates, station.lost))
+
+    def spool_status(self, spool_path=None):
+        status = BatchSpool(spool_path).status()
+        print('Queued batches:      {}'.format(status['queued']))
+        print('Awaiting commit:     {}'.format(status['submitted']))
+        print('Rejected batches:    {}'.format(status['invalid']))
+        print('Barcodes in flight:  {}'.format(status['barcodes']))
+        if status['oldest_age'] is not None:
+            print('Oldest batch:        {:.0f}s ago'.format(status['oldest_age']))
+        if status['last_error']:
+            print('Last error:          {}'.format(status['last_error']))
+
+    def spool_drain(self, spool_path=None):
+        spool = BatchSpool(spool_path)
+        # batches are already signed, no key is needed to send them
+        submitted, committed = spool.drain(self._client(spool=spool))
+        print('INFO: {} batches submitted, {} committed'.format(submitted, committed))
+
+    def export(self, path, fmt='csv', row_group_size=65536):
+        self._validate_user()
+        client = self._client(keyfile=self.key_file)
+        count = export_state(client, path, fmt=fmt, row_group_size=row_group_size)
+        print('INFO: Exported {} hops to {}'.format(count, path))
+
+    def import_catalog(self, dsn, checkpoint=None, chunk_size=1000, batch_size=100, max_in_flight=4, workers=None):
+        self._validate_user(restrict=True)
+        client = self._client(keyfile=self.key_file)
+        importer = CatalogImporter(client, dsn=dsn, checkpoint_path=checkpoint, chunk_size=chunk_size,
+                                   batch_size=batch_size, max_in_flight=max_in_flight, workers=workers)
+        imported, failed = importer.run()
+        print('INFO: Catalog import finished: {} imported, {} not committed'.format(imported, failed))
+
+    def verify_chain(self, b_id, history_file):
+        with open(history_file) as fd:
+            claimed = yaml.safe_load(fd) or []
+        hops = [(hop['location'], hop['signer'], float(hop['timestamp'])) for hop in claimed]
+        client = self._client()
+        digest, count = client.provenance_head(b_id)
+        if verify_history(hops, digest, count):
+            print('INFO: History of {} verified: {} hops, head {}'.format(b_id, count, digest))
+        else:
+            print('ERROR: History of {} does not match the chain ({} hops claimed, {} recorded, head {})'.format(
+                b_id, len(hops), count, digest))
+
+    def watch_events(self, validator_url, b_id=None):
+        tenant = family_tenant(tenant_family(self.tenant))
+        with BarcodeEventSubscriber(url=validator_url, barcode=b_id, tenant=tenant) as subscriber:
+            print('INFO: Waiting for events from {}'.format(validator_url))
+            for event in subscriber.events():
+                attributes = ', '.join('{}={}'.format(key, value) for key, value in sorted(event['attributes'].items()))
+                print('[block {}] {}: {}'.format(event['block_num'], event['event_type'], attributes))
+
     def add_user(self, username, keypath, tag, validate=True):
         if validate:
             self._validate_user()
@@ -333,7 +639,7 @@ class BarcodeOperations(object):
         else:
             priv_filename = keypath
 
-        client = BarcodeClient(base_url=DEFAULT_URL, keyfile=self.key_file if self.key_file else priv_filename)
+        client = self._client(keyfile=self.key_file if self.key_file else priv_filename)
         response = client.add_priv_key(user=username, keypath=priv_filename, tag=tag)
         print("Response: {}".format(response))
 
@@ -379,26 +685,26 @@ class BarcodeOperations(object):
         return key_dir
 
     def setup(self):
-        # generate admin key file
+        # generate admin key file and add the admin key to block chain. The
+        # processor only accepts this while no admin is registered yet, and
+        # the admin has to sign with its own key.
         self.add_user(username='admin', keypath=None, tag='admin', validate=False)
-        key_dir = self._setup_key_dir()
-
-        priv_filename = os.path.join(key_dir, 'admin' + '.priv')
-        pub_filename = os.path.join(key_dir, 'admin' + '.pub')
 
-        self._create_key_files(priv_filename, pub_filename)
-
-        # Add admin key to block chain
-        client = BarcodeClient(base_url=DEFAULT_URL, keyfile=priv_filename)
-        response = client.add_priv_key('admin', priv_filename, 'admin')
-        print("Admin user creation Response: {}".format(response))
+    def migrate_user(self):
+        # re-add the user's own record, signed with its key: the processor derives the role from it
+        self._validate_user()
+        username, tag, _ = self._get_user_from_block_chain()
+        client = self._client(keyfile=self.key_file)
+        response = client.add_priv_key(user=username, keypath=self.key_file, tag=tag)
+        print("Response: {}".format(response))
 
 
 def main():
     args = docopt(__doc__, version='Barcode 1.0')
     # print(args)
     username = args['--username'] if args['--username'] else 'admin'
-    barcode_ops = BarcodeOperations(username)
+    tenant = args['--tenant'] or load_client_config().get('tenant')
+    barcode_ops = BarcodeOperations(username, tenant=tenant)
     # validate user with action
     try:
         if args['setup']:
@@ -409,10 +715,33 @@ def main():
         if args['add']:
             tag = 'supplier' if args['supplier'] else 'admin'
             barcode_ops.add_user(args['<name>'], args['<keypath>'], tag)
+        if args['migrate']:
+            barcode_ops.migrate_user()
         if args['show']:
-            barcode_ops.show_chain(args['<barcode>'])
+            barcode_ops.show_chain(args['<barcode>'], at=args['--at'])
         if args['update']:
-            barcode_ops.update_chain(location=args['--location'], b_id=args['<barcode>'])
+            barcode_ops.update_chain(location=args['--location'], b_id=args['<barcode>'], spool_path=args['--spool'])
+        if args['station']:
+            barcode_ops.run_station(args['--location'], args['--camera'], args['--image'],
+                                    window=float(args['--window']), spool_path=args['--spool'])
+        if args['spool']:
+            if args['status']:
+                barcode_ops.spool_status(args['--spool'])
+            if args['drain']:
+                barcode_ops.spool_drain(args['--spool'])
+        if args['export']:
+            barcode_ops.export(args['--output'], fmt=args['--format'], row_group_size=int(args['--row-group-size']))
+        if args['import']:
+            barcode_ops.import_catalog(args['--dsn'], checkpoint=args['--checkpoint'],
+                                       chunk_size=int(args['--chunk-size']), batch_size=int(args['--batch-size']),
+                                       max_in_flight=int(args['--in-flight']),
+                                       workers=int(args['--workers']) if args['--workers'] else None)
+        if args['verify']:
+            barcode_ops.verify_chain(args['<barcode>'], args['--history'])
+        if args['watch']:
+            barcode_ops.watch_events(args['--validator'], b_id=args['<barcode>'])
+    except KeyboardInterrupt:
+        pass
     except Exception as e:
         print('ERROR: {e}'.format(e=e))
 
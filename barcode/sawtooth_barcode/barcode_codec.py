@@ -0,0 +1,86 @@
+"""Encoding of barcode records in state, shared by the processor and the clients.
+
+A state entry holds '|' separated records of the form
+'barcode,product name,manufacturing date,location', where location lists
+every hop the item crossed joined by '->'. Hops recorded with a time carry
+it as 'location@timestamp'; the initial location and hops recorded before
+timestamps were kept have none.
+"""
+
+import math
+
+LOCATION_SEPARATOR = '->'
+HOP_SEPARATOR = ';'
+HOP_TIMESTAMP_SEPARATOR = '@'
+RESERVED_LOCATION_CHARS = (',', '|', HOP_SEPARATOR, HOP_TIMESTAMP_SEPARATOR)
+
+
+def is_valid_location(location):
+    """A location must not contain anything the record or hop encodings use as a separator."""
+    return not any(char in location for char in RESERVED_LOCATION_CHARS) and LOCATION_SEPARATOR not in location
+
+
+def parse_state_data(state_data):
+    return {b_id: (product_name, mfg_date, location) for
+            b_id, product_name, mfg_date, location in
+            [barcode.split(',') for barcode in state_data.decode().split('|')]}
+
+
+def serialize_state_data(barcode_list):
+    return '|'.join(sorted(
+        [','.join([str(idd), str(product_name), str(mfg_date), location]) for idd, (product_name, mfg_date, location) in
+         barcode_list.items()])).encode()
+
+
+def append_location(barcode_list, upd_location, timestamp=None):
+    if timestamp is not None:
+        upd_location = '{}{}{!r}'.format(upd_location, HOP_TIMESTAMP_SEPARATOR, float(timestamp))
+    suffix = '{} {}'.format(LOCATION_SEPARATOR, upd_location)
+    return {b_id: (product_name, mfg_date, location + suffix) for
+            b_id, (product_name, mfg_date, location) in barcode_list.items()}
+
+
+def split_hops(location):
+    """Returns [(location, timestamp or None), ...] for a stored location string."""
+    hops = []
+    for hop in location.split(LOCATION_SEPARATOR):
+        hop_location, separator, timestamp = hop.strip().rpartition(HOP_TIMESTAMP_SEPARATOR)
+        try:
+            hops.append((hop_location, float(timestamp)) if separator else (timestamp, None))
+        except ValueError:
+            # an old location that happens to contain the separator
+            hops.append((hop.strip(), None))
+    return hops
+
+
+def split_locations(location):
+    return [hop_location for hop_location, _ in split_hops(location)]
+
+
+def format_locations(location):
+    """The location string without hop timestamps, as shown to users."""
+    return '{} '.format(LOCATION_SEPARATOR).join(split_locations(location))
+
+
+def encode_hops(hops):
+    """Encodes [(location, timestamp), ...] as 'location@timestamp;location@timestamp'."""
+    for location, timestamp in hops:
+        if not location or not is_valid_location(location):
+            raise ValueError('Invalid hop location: {}'.format(location))
+        if not math.isfinite(timestamp):
+            raise ValueError('Invalid hop time: {}'.format(timestamp))
+    return HOP_SEPARATOR.join('{}{}{!r}'.format(location, HOP_TIMESTAMP_SEPARATOR, float(timestamp))
+                              for location, timestamp in hops)
+
+
+def decode_hops(encoded):
+    hops = []
+    for hop in encoded.split(HOP_SEPARATOR):
+        location, timestamp = hop.split(HOP_TIMESTAMP_SEPARATOR)
+        if not location or not is_valid_location(location):
+            raise ValueError('Invalid hop location: {}'.format(location))
+        timestamp = float(timestamp)
+        if not math.isfinite(timestamp):
+            raise ValueError('Invalid hop time: {}'.format(timestamp))
+        hops.append((location, timestamp))
+    return hops
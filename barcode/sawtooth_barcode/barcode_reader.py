@@ -129,11 +129,19 @@ import pygame.image
 import pygame.surfarray
 
 
+def image_to_array(pygame_image):
+    image_ndarray = pygame.surfarray.array3d(pygame_image)
+    if len(image_ndarray.shape) == 3:
+        image_ndarray = zbar.misc.rgb2gray(image_ndarray)
+
+    return image_ndarray
+
+
 class BarcodeReader(object):
 
-    def __init__(self):
-        self.cam_name = '/dev/video0'
-        self.cam_resolution = (640, 480)  # A general cam resolution
+    def __init__(self, cam_name='/dev/video0', cam_resolution=(640, 480)):
+        self.cam_name = cam_name
+        self.cam_resolution = cam_resolution  # A general cam resolution
         self.scanner = zbar.Scanner()
 
     def get_image_array_from_cam(self):
@@ -156,21 +164,16 @@ class BarcodeReader(object):
                 break
 
         pygame.display.quit()
-        image_ndarray = pygame.surfarray.array3d(pygame_screen_image)
-        if len(image_ndarray.shape) == 3:
-            image_ndarray = zbar.misc.rgb2gray(image_ndarray)
+        return image_to_array(pygame_screen_image)
 
-        return image_ndarray
+    def decode(self, img_array):
+        results = self.scanner.scan(img_array)
+        return [result.data.decode("ascii") for result in results]
 
     def read_barcode_by_cam(self):
         img_array = self.get_image_array_from_cam()
-        results = self.scanner.scan(img_array)
-        if results == []:
+        barcodes = self.decode(img_array)
+        if barcodes == []:
             return None
         else:
-            for result in results:
-                return result.data.decode("ascii")
-
-
-
-
+            return barcodes[0]
@@ -0,0 +1,97 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sawtooth_sdk.protobuf.batch_pb2 import Batch
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+from sawtooth_signing import CryptoFactory
+from sawtooth_signing import create_context
+from sawtooth_signing.secp256k1 import Secp256k1PrivateKey
+
+from sawtooth_barcode.addressing import transaction_addresses
+from sawtooth_barcode.txn_builder import FAMILY_NAME
+from sawtooth_barcode.txn_builder import make_batch
+from sawtooth_barcode.txn_builder import make_payload
+from sawtooth_barcode.txn_builder import make_transaction
+
+# per worker process state, set once by _init_worker
+_WORKER_SIGNER = None
+_WORKER_PREFIX = None
+_WORKER_FAMILY = None
+
+
+def _init_worker(private_key_hex, prefix, family_name):
+    global _WORKER_SIGNER, _WORKER_PREFIX, _WORKER_FAMILY
+    private_key = Secp256k1PrivateKey.from_hex(private_key_hex)
+    _WORKER_SIGNER = CryptoFactory(create_context('secp256k1')).new_signer(private_key)
+    _WORKER_PREFIX = prefix
+    _WORKER_FAMILY = family_name
+
+
+def _sign_batch(txn_specs):
+    start = time.process_time()
+    transactions = []
+    for name, action, location in txn_specs:
+        inputs, outputs = transaction_addresses(_WORKER_PREFIX, name, action)
+        transactions.append(make_transaction(_WORKER_SIGNER, make_payload(name, action, location),
+                                             inputs=inputs, outputs=outputs, family_name=_WORKER_FAMILY))
+    batch = make_batch(_WORKER_SIGNER, transactions)
+    return batch.SerializeToString(), time.process_time() - start
+
+
+class BulkSigner(object):
+    """Builds and signs batches for many transactions across a process pool.
+
+    Each worker loads the private key once when it starts. Transaction specs
+    are (name, action, location) tuples; batches and batch lists come back in
+    the order of the specs.
+    """
+
+    def __init__(self, private_key_hex, prefix, workers=None, family_name=FAMILY_NAME):
+        self._private_key_hex = private_key_hex
+        self._prefix = prefix
+        self._family_name = family_name
+        self.workers = workers or multiprocessing.cpu_count()
+        self._executor = None
+        self.stats = {}
+
+    def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(self._private_key_hex, self._prefix, self._family_name))
+        return self
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def sign_batches(self, txn_specs, txns_per_batch=100):
+        chunks = [txn_specs[i:i + txns_per_batch] for i in range(0, len(txn_specs), txns_per_batch)]
+        start = time.time()
+        batches = []
+        cpu_seconds = 0.0
+        for serialized, cpu_time in self._executor.map(_sign_batch, chunks):
+            batch = Batch()
+            batch.ParseFromString(serialized)
+            batches.append(batch)
+            cpu_seconds += cpu_time
+        wall_seconds = time.time() - start
+
+        self.stats = {
+            'transactions': len(txn_specs),
+            'workers': self.workers,
+            'wall_seconds': wall_seconds,
+            'transactions_per_second': len(txn_specs) / wall_seconds if wall_seconds else 0.0,
+            'transactions_per_second_per_core': len(txn_specs) / cpu_seconds if cpu_seconds else 0.0,
+        }
+        return batches
+
+    def build_batch_lists(self, txn_specs, txns_per_batch=100, batches_per_list=10):
+        batches = self.sign_batches(txn_specs, txns_per_batch=txns_per_batch)
+        return [BatchList(batches=batches[i:i + batches_per_list]) for i in range(0, len(batches), batches_per_list)]
@@ -0,0 +1,234 @@
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+import yaml
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+
+DEFAULT_DSN = 'dbname=barcode user=barcode_user password=shroot12'
+STATUS_CHUNK_SIZE = 50
+
+
+def _default_checkpoint_path(family_name):
+    # one per tenant, each imports the catalog into its own namespace
+    return os.path.join(os.path.expanduser('~'), '.sawtooth', '{}_import.checkpoint'.format(family_name))
+
+
+def _offsets(batches):
+    offset = 0
+    for batch in batches:
+        yield offset
+        offset += len(batch.transactions)
+
+
+def _batches(barcode_ids, batch_list):
+    """[(batch id, the barcode ids it creates)] of a chunk's BatchList."""
+    return [(batch.header_signature, [str(b_id) for b_id in barcode_ids[i:i + len(batch.transactions)]])
+            for batch, i in zip(batch_list.batches, _offsets(batch_list.batches))]
+
+
+class CatalogImporter(object):
+    """Creates a chain for every row of barcode_details.
+
+    Rows are streamed through a server-side cursor, so only one chunk is held
+    in memory. Every chunk becomes one BatchList of create transactions and at
+    most max_in_flight of them are outstanding at a time. The checkpoint only
+    moves past a chunk once every batch of it and of every earlier chunk has
+    been settled, so an interrupted import resumes without resubmitting
+    settled rows.
+
+    Rows are never dropped: barcodes of batches that were rejected or lost
+    are kept in the checkpoint and submitted again at the start of the next
+    run, one batch per barcode, and batches still PENDING after commit_wait
+    are kept by batch id and looked up again then. The processor refuses to
+    create an item twice, so a barcode that was created after all keeps
+    failing on its own and is reported by `failed`.
+    """
+
+    def __init__(self, client, dsn=DEFAULT_DSN, checkpoint_path=None, chunk_size=1000, batch_size=100,
+                 max_in_flight=4, commit_wait=300, workers=None):
+        self._client = client
+        self._dsn = dsn
+        self._checkpoint_path = checkpoint_path or _default_checkpoint_path(client._family_name)
+        self._chunk_size = chunk_size
+        self._batch_size = batch_size
+        self._max_in_flight = max_in_flight
+        self._commit_wait = commit_wait
+        self._workers = workers
+        self._signer = None
+        self._retry = []
+        self._unsettled = {}
+        self.imported = 0
+        self.failed = 0
+
+    def _load_checkpoint(self):
+        if not os.path.isfile(self._checkpoint_path):
+            return None
+        with open(self._checkpoint_path) as fd:
+            checkpoint = yaml.safe_load(fd) or {}
+        self.imported = checkpoint.get('imported', 0)
+        self._retry = checkpoint.get('retry', [])
+        self._unsettled = checkpoint.get('unsettled', {})
+        return checkpoint.get('last_barcode_id')
+
+    def _save_checkpoint(self, last_barcode_id):
+        checkpoint_dir = os.path.dirname(self._checkpoint_path)
+        if checkpoint_dir and not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir, 0o755)
+        tmp_path = self._checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as fd:
+            yaml.safe_dump({'last_barcode_id': str(last_barcode_id) if last_barcode_id is not None else None,
+                            'imported': self.imported, 'retry': self._retry, 'unsettled': self._unsettled},
+                           fd, default_flow_style=False)
+        os.replace(tmp_path, self._checkpoint_path)
+
+    def _rows(self, last_barcode_id):
+        conn = psycopg2.connect(self._dsn)
+        try:
+            # a named cursor keeps the result set on the server and fetches it itersize rows at a time
+            cur = conn.cursor(name='barcode_catalog_import')
+            cur.itersize = self._chunk_size
+            if last_barcode_id is None:
+                cur.execute('select barcode_id from barcode_details order by barcode_id')
+            else:
+                cur.execute('select barcode_id from barcode_details where barcode_id > %s order by barcode_id',
+                            (last_barcode_id,))
+            while True:
+                rows = cur.fetchmany(self._chunk_size)
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+            cur.close()
+        finally:
+            conn.close()
+
+    def _build_batch_list(self, barcode_ids, batch_size):
+        if self._signer is not None:
+            batches = self._signer.sign_batches([(str(b_id), 'create', '') for b_id in barcode_ids],
+                                                txns_per_batch=batch_size)
+            return BatchList(batches=batches)
+        transactions = [self._client._create_transaction(str(b_id), 'create') for b_id in barcode_ids]
+        batches = [self._client._create_batch(transactions[i:i + batch_size])
+                   for i in range(0, len(transactions), batch_size)]
+        return BatchList(batches=batches)
+
+    def _submit(self, batch_list):
+        self._client.send_batch_list(batch_list)
+        batch_ids = [batch.header_signature for batch in batch_list.batches]
+        return self._client.get_batch_statuses(batch_ids, self._commit_wait)
+
+    def _record_statuses(self, batches, statuses):
+        """batches is [(batch_id, barcode ids)]; returns how many barcodes did not commit."""
+        not_committed = 0
+        for batch_id, barcode_ids in batches:
+            status = statuses.get(batch_id)
+            if status == 'COMMITTED':
+                self.imported += len(barcode_ids)
+                continue
+            not_committed += len(barcode_ids)
+            if status == 'PENDING':
+                self._unsettled[batch_id] = barcode_ids
+            else:
+                # INVALID or lost by the validator
+                self._retry.extend(barcode_ids)
+        return not_committed
+
+    def _resolve_unsettled(self):
+        if not self._unsettled:
+            return
+        unsettled, self._unsettled = self._unsettled, {}
+        batch_ids = list(unsettled)
+        statuses = {}
+        for start in range(0, len(batch_ids), STATUS_CHUNK_SIZE):
+            statuses.update(self._client.get_batch_statuses(batch_ids[start:start + STATUS_CHUNK_SIZE], 0))
+        self._record_statuses(unsettled.items(), statuses)
+
+    def _forget_retry(self, barcode_ids):
+        # a retried chunk, its rows are tracked again by batch from here on
+        retried = set(str(b_id) for b_id in barcode_ids)
+        self._retry = [b_id for b_id in self._retry if b_id not in retried]
+
+    def _settle(self, pending, last_barcode_id):
+        future, barcode_ids, batch_list, advance = pending[0]
+        statuses = future.result()
+        # left in pending if the submission failed, so _abandon() keeps track of it
+        pending.popleft()
+        if not advance:
+            self._forget_retry(barcode_ids)
+        not_committed = self._record_statuses(_batches(barcode_ids, batch_list), statuses)
+        if not_committed:
+            print('WARNING: {} of {} barcodes ending at {} were not confirmed as committed, kept for the next run'.format(
+                not_committed, len(barcode_ids), barcode_ids[-1]))
+        if advance:
+            last_barcode_id = barcode_ids[-1]
+        self._save_checkpoint(last_barcode_id)
+        print('INFO: Imported {} barcodes (last {})'.format(self.imported, barcode_ids[-1]))
+        if self._signer is not None:
+            print('INFO: Signing {transactions_per_second_per_core:.0f} txn/s per core on {workers} workers'.format(
+                **self._signer.stats))
+        return last_barcode_id
+
+    def _abandon(self, pending, last_barcode_id):
+        """Keeps every chunk still in flight as unsettled when a run fails.
+
+        Any of them may have reached the validator, so the next run looks
+        their batches up instead of signing and submitting the rows again;
+        one that never got there is UNKNOWN then and its rows are retried.
+        """
+        for future, barcode_ids, batch_list, advance in pending:
+            future.cancel()
+            self._unsettled.update(_batches(barcode_ids, batch_list))
+            if advance:
+                last_barcode_id = barcode_ids[-1]
+            else:
+                self._forget_retry(barcode_ids)
+        self._save_checkpoint(last_barcode_id)
+        if pending:
+            print('WARNING: Import interrupted, {} chunks in flight are looked up again by the next run'.format(
+                len(pending)))
+
+    def _chunks(self, last_barcode_id):
+        """Yields (barcode ids, advance): retried rows first, then the catalog from the checkpoint on."""
+        retry = list(self._retry)
+        for i in range(0, len(retry), self._chunk_size):
+            yield retry[i:i + self._chunk_size], False
+        for barcode_ids in self._rows(last_barcode_id):
+            yield barcode_ids, True
+
+    def run(self):
+        last_barcode_id = self._load_checkpoint()
+        if last_barcode_id is not None:
+            print('INFO: Resuming import after barcode {}'.format(last_barcode_id))
+        self._resolve_unsettled()
+        if self._retry:
+            print('INFO: Retrying {} barcodes that did not commit in an earlier run'.format(len(self._retry)))
+
+        if self._workers:
+            self._signer = self._client.bulk_signer(workers=self._workers).start()
+
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self._max_in_flight) as executor:
+            try:
+                for barcode_ids, advance in self._chunks(last_barcode_id):
+                    # a retried row gets a batch of its own, one that already exists only fails itself
+                    batch_list = self._build_batch_list(barcode_ids, self._batch_size if advance else 1)
+                    pending.append((executor.submit(self._submit, batch_list), barcode_ids, batch_list, advance))
+                    # settle in submission order so the checkpoint never skips an unfinished chunk
+                    while len(pending) > self._max_in_flight:
+                        last_barcode_id = self._settle(pending, last_barcode_id)
+                while pending:
+                    last_barcode_id = self._settle(pending, last_barcode_id)
+                self._save_checkpoint(last_barcode_id)
+            except BaseException:
+                self._abandon(pending, last_barcode_id)
+                raise
+            finally:
+                for future, _, _, _ in pending:
+                    future.cancel()
+                if self._signer is not None:
+                    self._signer.close()
+                    self._signer = None
+
+        self.failed = len(self._retry) + sum(len(barcode_ids) for barcode_ids in self._unsettled.values())
+        return self.imported, self.failed
@@ -0,0 +1,159 @@
+import collections
+import logging
+import threading
+import time
+
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+
+from sawtooth_barcode.cache import LRUCache
+
+LOGGER = logging.getLogger(__name__)
+
+STATUS_CHUNK_SIZE = 50
+
+
+class HopCoalescer(object):
+    """Merges location updates for the same barcode that arrive within a window.
+
+    Hops are buffered for `window` seconds after the first one. At flush time
+    every barcode becomes one 'move' transaction carrying the ordered hop
+    list with each hop's scan time, even for a single hop: an 'update' would
+    be timed by its nonce, i.e. when it was flushed. Every barcode gets its
+    own batch, all batches of a flush go out in one BatchList. If that
+    submission fails the hops go back into the buffer and are sent with the
+    next flush.
+
+    A transaction declares the previous flush's transaction for the same
+    barcode as a dependency, so hops keep their order even when the
+    validator schedules batches differently. Before a flush the status of
+    those earlier batches is looked up; one the validator rejected or lost
+    can never commit, so later hops stop depending on it.
+
+    Coalescing needs a long-running process that sees many updates, such as
+    barcode_gateway --coalesce; a barcode_cli invocation sends a single
+    update and exits, there is nothing to merge it with.
+    """
+
+    def __init__(self, client, window=2.0, max_hops=50):
+        self._client = client
+        self._window = window
+        self._max_hops = max_hops
+        self._pending = collections.OrderedDict()
+        self._first_hop = None
+        self._flush_requested = False
+        self._last_txn = LRUCache(maxsize=65536)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.submitted_hops = 0
+        self.submitted_transactions = 0
+
+    def add(self, b_id, location, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            hops = self._pending.setdefault(b_id, [])
+            hops.append((location, timestamp))
+            if self._first_hop is None:
+                self._first_hop = time.time()
+            if len(hops) >= self._max_hops:
+                # flushed by the coalescer thread right away, add() never waits for the network
+                self._flush_requested = True
+
+    def _take(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = collections.OrderedDict()
+            self._first_hop = None
+            self._flush_requested = False
+        return pending
+
+    def _restore(self, pending):
+        # the failed hops are older than anything added since, so they go first
+        with self._lock:
+            for b_id, hops in self._pending.items():
+                pending.setdefault(b_id, []).extend(hops)
+            self._pending = pending
+            if self._first_hop is None:
+                self._first_hop = time.time()
+
+    def _dependencies(self, b_ids):
+        """Maps each barcode whose previous transaction is still pending to that transaction's id."""
+        previous = {}
+        for b_id in b_ids:
+            entry = self._last_txn.get(b_id)
+            if entry is not None:
+                previous[b_id] = entry
+        batch_ids = sorted(set(batch_id for _, batch_id in previous.values()))
+        statuses = {}
+        for start in range(0, len(batch_ids), STATUS_CHUNK_SIZE):
+            statuses.update(self._client.get_batch_statuses(batch_ids[start:start + STATUS_CHUNK_SIZE], 0))
+
+        dependencies = {}
+        for b_id, (txn_id, batch_id) in previous.items():
+            status = statuses.get(batch_id)
+            if status == 'PENDING':
+                dependencies[b_id] = txn_id
+                continue
+            # committed, nothing left to wait for; rejected or lost, it never will be
+            self._last_txn.discard(b_id)
+            if status != 'COMMITTED':
+                LOGGER.warning('Batch %s with hops of barcode %s is %s, later hops no longer depend on it',
+                               batch_id, b_id, status)
+        return dependencies
+
+    def flush(self):
+        pending = self._take()
+        if not pending:
+            return None
+
+        try:
+            dependencies = self._dependencies(pending)
+            batches = []
+            for b_id, hops in pending.items():
+                previous = dependencies.get(b_id)
+                transaction = self._client._create_move_transaction(b_id, hops,
+                                                                    dependencies=[previous] if previous else None)
+                batches.append(self._client._create_batch([transaction]))
+
+            batch_list = BatchList(batches=batches)
+            response = self._client.send_batch_list(batch_list)
+        except Exception:
+            self._restore(pending)
+            raise
+        # only a submitted transaction may become the dependency of the barcode's next hops
+        for (b_id, hops), batch in zip(pending.items(), batch_list.batches):
+            self._last_txn.put(b_id, (batch.transactions[0].header_signature, batch.header_signature))
+            self._client._overlay_hops(b_id, hops, batch.header_signature)
+        self.submitted_transactions += len(batches)
+        self.submitted_hops += sum(len(hops) for hops in pending.values())
+        return response
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            with self._lock:
+                due = self._flush_requested or (self._first_hop is not None and
+                                                time.time() - self._first_hop >= self._window)
+            if due:
+                try:
+                    self.flush()
+                except Exception:  # pylint: disable=broad-except
+                    LOGGER.exception('Failed to submit coalesced hops')
+            self._stop_event.wait(min(0.05, self._window))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='hop-coalescer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        try:
+            self.flush()
+        except Exception:  # pylint: disable=broad-except
+            with self._lock:
+                lost = sum(len(hops) for hops in self._pending.values())
+            LOGGER.exception('Failed to submit the last coalesced hops, %s hops of %s barcodes are lost',
+                             lost, len(self._pending))
@@ -0,0 +1,148 @@
+import uuid
+
+import zmq
+from sawtooth_sdk.protobuf.client_event_pb2 import ClientEventsSubscribeRequest
+from sawtooth_sdk.protobuf.client_event_pb2 import ClientEventsSubscribeResponse
+from sawtooth_sdk.protobuf.client_event_pb2 import ClientEventsUnsubscribeRequest
+from sawtooth_sdk.protobuf.events_pb2 import EventFilter
+from sawtooth_sdk.protobuf.events_pb2 import EventList
+from sawtooth_sdk.protobuf.events_pb2 import EventSubscription
+from sawtooth_sdk.protobuf.network_pb2 import PingResponse
+from sawtooth_sdk.protobuf.validator_pb2 import Message
+
+DEFAULT_VALIDATOR_URL = 'tcp://127.0.0.1:4004'
+BARCODE_EVENT_TYPES = ('barcode/created', 'barcode/moved', 'user/added')
+
+
+class BarcodeEventSubscriber(object):
+    """Streams barcode events from the validator's event subscription socket.
+
+    Every event is yielded as a dict together with the block that committed it:
+
+        {'event_type': 'barcode/moved', 'block_id': ..., 'block_num': 12,
+         'attributes': {'tenant': ..., 'barcode': ..., 'location': ..., 'signer': ...}, 'data': b''}
+
+    Every tenant emits the same event types; with tenant set only events
+    carrying that 'tenant' attribute are streamed.
+
+    With state_delta_prefix set, 'sawtooth/state-delta' events for addresses
+    under that prefix are streamed as well; their data is a serialized
+    StateChangeList. events(include_block_commits=True) also yields the
+    'sawtooth/block-commit' event of every block, after the block's other
+    events, for callers that track the chain head.
+    """
+
+    def __init__(self, url=DEFAULT_VALIDATOR_URL, event_types=BARCODE_EVENT_TYPES, barcode=None,
+                 state_delta_prefix=None, tenant=None):
+        self._url = url
+        self._event_types = event_types
+        self._barcode = barcode
+        self._tenant = tenant
+        self._state_delta_prefix = state_delta_prefix
+        self._context = None
+        self._socket = None
+
+    def _subscriptions(self):
+        filters = []
+        if self._barcode is not None:
+            filters.append(EventFilter(key='barcode', match_string=self._barcode,
+                                       filter_type=EventFilter.SIMPLE_ALL))
+        if self._tenant is not None:
+            filters.append(EventFilter(key='tenant', match_string=self._tenant,
+                                       filter_type=EventFilter.SIMPLE_ALL))
+        subscriptions = [EventSubscription(event_type=event_type, filters=filters)
+                         for event_type in self._event_types]
+        if self._state_delta_prefix is not None:
+            subscriptions.append(EventSubscription(
+                event_type='sawtooth/state-delta',
+                filters=[EventFilter(key='address', match_string='^{}.*'.format(self._state_delta_prefix),
+                                     filter_type=EventFilter.REGEX_ANY)]))
+        subscriptions.append(EventSubscription(event_type='sawtooth/block-commit'))
+        return subscriptions
+
+    def _request(self, message_type, content):
+        message = Message(correlation_id=uuid.uuid4().hex, message_type=message_type,
+                          content=content.SerializeToString())
+        self._socket.send_multipart([message.SerializeToString()])
+
+    def _receive(self):
+        while True:
+            message = Message()
+            message.ParseFromString(self._socket.recv_multipart()[0])
+            if message.message_type != Message.PING_REQUEST:
+                return message
+            # the validator drops connections that stop answering its pings
+            response = Message(correlation_id=message.correlation_id, message_type=Message.PING_RESPONSE,
+                               content=PingResponse().SerializeToString())
+            self._socket.send_multipart([response.SerializeToString()])
+
+    def subscribe(self, last_known_block_ids=None):
+        self._context = zmq.Context()
+        self._socket = self._context.socket(zmq.DEALER)
+        self._socket.connect(self._url)
+
+        self._request(Message.CLIENT_EVENTS_SUBSCRIBE_REQUEST, ClientEventsSubscribeRequest(
+            subscriptions=self._subscriptions(), last_known_block_ids=last_known_block_ids or []))
+        message = self._receive()
+        if message.message_type != Message.CLIENT_EVENTS_SUBSCRIBE_RESPONSE:
+            raise Exception('Unexpected message type {} while subscribing'.format(message.message_type))
+        response = ClientEventsSubscribeResponse()
+        response.ParseFromString(message.content)
+        if response.status != ClientEventsSubscribeResponse.OK:
+            raise Exception('Event subscription failed: {}'.format(response.response_message or response.status))
+
+    def unsubscribe(self):
+        if self._socket is None:
+            return
+        try:
+            self._request(Message.CLIENT_EVENTS_UNSUBSCRIBE_REQUEST, ClientEventsUnsubscribeRequest())
+            self._receive()
+        finally:
+            self._socket.close(linger=0)
+            self._context.term()
+            self._socket = None
+            self._context = None
+
+    def events(self, include_block_commits=False):
+        if self._socket is None:
+            self.subscribe()
+        while True:
+            message = self._receive()
+            if message.message_type != Message.CLIENT_EVENTS:
+                continue
+            event_list = EventList()
+            event_list.ParseFromString(message.content)
+
+            block_id = block_num = None
+            block_commits = []
+            for event in event_list.events:
+                if event.event_type == 'sawtooth/block-commit':
+                    attributes = {attr.key: attr.value for attr in event.attributes}
+                    block_id = attributes.get('block_id')
+                    block_num = int(attributes.get('block_num', 0))
+                    block_commits.append(event)
+
+            for event in event_list.events:
+                if event.event_type == 'sawtooth/block-commit':
+                    continue
+                yield _event_dict(event, block_id, block_num)
+            if include_block_commits:
+                for event in block_commits:
+                    yield _event_dict(event, block_id, block_num)
+
+    def __enter__(self):
+        self.subscribe()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.unsubscribe()
+
+
+def _event_dict(event, block_id, block_num):
+    return {
+        'event_type': event.event_type,
+        'block_id': block_id,
+        'block_num': block_num,
+        'attributes': {attr.key: attr.value for attr in event.attributes},
+        'data': event.data,
+    }
@@ -0,0 +1,108 @@
+import base64
+import csv
+
+import yaml
+
+from sawtooth_barcode.barcode_codec import parse_state_data
+from sawtooth_barcode.barcode_codec import split_hops
+from sawtooth_barcode.history import relative_suffix
+
+COLUMNS = ('barcode', 'product_name', 'mfg_date', 'hop', 'location', 'timestamp')
+
+
+def iter_state_entries(client, page_size=1000):
+    """Yields (address, data) for every entry under the barcode namespace, one page at a time."""
+    suffix = 'state?address={}&limit={}'.format(client._get_prefix(), page_size)
+    while suffix:
+        page = yaml.safe_load(client._send_request(suffix))
+        for entry in page['data']:
+            yield entry['address'], base64.b64decode(entry['data'])
+        next_url = page.get('paging', {}).get('next')
+        suffix = relative_suffix(next_url) if next_url else None
+
+
+def iter_hop_rows(entries):
+    for _, data in entries:
+        try:
+            barcode_list = parse_state_data(data)
+        except (ValueError, UnicodeDecodeError):
+            # user records share the namespace and do not decode as barcodes
+            continue
+        for b_id, (product_name, mfg_date, location) in sorted(barcode_list.items()):
+            for hop, (hop_location, timestamp) in enumerate(split_hops(location)):
+                yield b_id, product_name, mfg_date, hop, hop_location, timestamp
+
+
+class CsvExportWriter(object):
+
+    def __init__(self, path):
+        self._fd = open(path, 'w', newline='')
+        self._writer = csv.writer(self._fd)
+        self._writer.writerow(COLUMNS)
+
+    def write_rows(self, rows):
+        self._writer.writerows(rows)
+
+    def close(self):
+        self._fd.close()
+
+
+class ParquetExportWriter(object):
+
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise Exception('pyarrow is required for parquet export: pip install pyarrow')
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([
+            ('barcode', pyarrow.string()),
+            ('product_name', pyarrow.string()),
+            ('mfg_date', pyarrow.string()),
+            ('hop', pyarrow.int32()),
+            ('location', pyarrow.string()),
+            ('timestamp', pyarrow.float64()),
+        ])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema)
+
+    def write_rows(self, rows):
+        columns = list(zip(*rows))
+        table = self._pa.Table.from_arrays([self._pa.array(column, type=field.type)
+                                            for column, field in zip(columns, self._schema)], schema=self._schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {
+    'csv': CsvExportWriter,
+    'parquet': ParquetExportWriter,
+}
+
+
+def export_state(client, path, fmt='csv', row_group_size=65536, page_size=1000):
+    """Writes one row per hop of every barcode in state to path.
+
+    Rows are flushed every row_group_size rows (one parquet row group each),
+    so memory stays bounded however large the namespace is.
+    """
+    if fmt not in WRITERS:
+        raise Exception('Unsupported export format {}: expected one of {}'.format(fmt, ', '.join(sorted(WRITERS))))
+    writer = WRITERS[fmt](path)
+    count = 0
+    try:
+        rows = []
+        for row in iter_hop_rows(iter_state_entries(client, page_size=page_size)):
+            rows.append(row)
+            if len(rows) >= row_group_size:
+                writer.write_rows(rows)
+                count += len(rows)
+                rows = []
+        if rows:
+            writer.write_rows(rows)
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
@@ -0,0 +1,328 @@
+"""HTTP gateway for retail terminals.
+
+    POST /barcodes                       {"barcode": "..."}
+    POST /barcodes/{barcode}/locations   {"location": "..."}
+    GET  /barcodes/{barcode}
+
+Writes answer 202 with the batch id once the validator accepted the batch.
+All terminals share the gateway's signer and its pooled connections to the
+REST API. With --coalesce, location updates are buffered instead and
+answered 202 right away; updates of one barcode arriving within the window
+are submitted as a single multi-hop transaction.
+
+Every request must carry 'Authorization: Bearer <token>' with one of the
+terminal tokens listed in the --tokens file, a YAML mapping of terminal
+name to token. The gateway listens on localhost unless told otherwise.
+"""
+
+import argparse
+import asyncio
+import base64
+import hmac
+import json
+import logging
+import os
+import re
+
+import aiohttp
+import yaml
+from aiohttp import web
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+
+from sawtooth_barcode.barcode_cli import BarcodeClient
+from sawtooth_barcode.barcode_cli import DEFAULT_URL
+from sawtooth_barcode.barcode_codec import is_valid_location
+from sawtooth_barcode.barcode_codec import parse_state_data
+from sawtooth_barcode.barcode_codec import split_hops
+from sawtooth_barcode.coalescer import HopCoalescer
+from sawtooth_barcode.rate_control import backoff_delay
+from sawtooth_barcode.state_cache import ClientStateCache
+
+LOGGER = logging.getLogger(__name__)
+
+
+class GatewayError(Exception):
+
+    def __init__(self, status, message):
+        super(GatewayError, self).__init__(message)
+        self.status = status
+
+
+class BatchWriter(object):
+    """Collects the batches of concurrent requests into shared BatchLists.
+
+    The first write opens a window of `window` seconds (a few milliseconds);
+    every batch queued meanwhile, up to max_batches, goes to the REST API in
+    a single POST. Each request keeps its own batch, so one invalid
+    transaction only fails the terminal that sent it.
+    """
+
+    def __init__(self, gateway, window=0.005, max_batches=100, max_retries=8):
+        self._gateway = gateway
+        self._window = window
+        self._max_batches = max_batches
+        self._max_retries = max_retries
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def submit(self, batch):
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((batch, future))
+        return await future
+
+    async def _collect(self):
+        pending = [await self._queue.get()]
+        deadline = asyncio.get_event_loop().time() + self._window
+        while len(pending) < self._max_batches:
+            timeout = deadline - asyncio.get_event_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return pending
+
+    async def _run(self):
+        while True:
+            pending = await self._collect()
+            batch_list = BatchList(batches=[batch for batch, _ in pending])
+            try:
+                await self._post(batch_list.SerializeToString())
+            except Exception as e:  # pylint: disable=broad-except
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for batch, future in pending:
+                if not future.done():
+                    future.set_result(batch.header_signature)
+
+    async def _post(self, data):
+        attempt = 0
+        while True:
+            status, text = await self._gateway.request('POST', 'batches', data=data,
+                                                       content_type='application/octet-stream')
+            if status != 429 or attempt >= self._max_retries:
+                break
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+        if status == 429:
+            raise GatewayError(503, 'Validator queue full')
+        if status >= 400:
+            raise GatewayError(502, 'REST API error {}: {}'.format(status, text))
+
+
+class BarcodeGateway(object):
+
+    def __init__(self, base_url, keyfile, tokens, window=0.005, max_batches=100, connections=32,
+                 validator_url=None, tenant=None, coalesce_window=0):
+        if not base_url.startswith('http://'):
+            base_url = 'http://' + base_url
+        self._base_url = base_url
+        # one signer for every terminal, reused only for building and signing
+        self._client = BarcodeClient(base_url=base_url, keyfile=keyfile, tenant=tenant)
+        # terminal name by token
+        self._tokens = {token: terminal for terminal, token in tokens.items()}
+        self._cache = ClientStateCache()
+        self._window = window
+        self._max_batches = max_batches
+        self._writer = None
+        self._connections = connections
+        self._validator_url = validator_url
+        self._coalesce_window = coalesce_window
+        self._coalescer = None
+        self._session = None
+
+    async def request(self, method, suffix, data=None, content_type=None):
+        headers = {'Content-Type': content_type} if content_type else None
+        async with self._session.request(method, '{}/{}'.format(self._base_url, suffix), data=data,
+                                         headers=headers) as response:
+            return response.status, await response.text()
+
+    async def read_state(self, b_id):
+        address = self._client._get_address(b_id)
+        head = self._cache.fresh_head()
+        if head is not None:
+            cached = self._cache.get(address, head)
+            if cached is not None:
+                return cached[0]
+        # unpinned while no head is known, the answer names the head it was read at
+        suffix = 'state/{}?head={}'.format(address, head) if head is not None else 'state/{}'.format(address)
+        status, text = await self.request('GET', suffix)
+        if status == 404:
+            data = None
+        elif status == 200:
+            response = json.loads(text)
+            data = base64.b64decode(response['data'])
+            if head is None:
+                head = response.get('head')
+                if head is not None:
+                    self._cache.set_head(head)
+        else:
+            raise GatewayError(502, 'REST API error {}'.format(status))
+        if head is not None:
+            self._cache.put(address, head, (data,))
+        return data
+
+    def _sign(self, b_id, action, location):
+        transaction = self._client._create_transaction(b_id, action, location)
+        return self._client._create_batch([transaction])
+
+    async def write(self, b_id, action, location=''):
+        # two secp256k1 signatures per write, kept off the event loop
+        batch = await asyncio.get_event_loop().run_in_executor(None, self._sign, b_id, action, location)
+        return await self._writer.submit(batch)
+
+    def _terminal(self, request):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() == 'bearer' and token:
+            for known, terminal in self._tokens.items():
+                if hmac.compare_digest(known.encode(), token.encode()):
+                    return terminal
+        return None
+
+    async def handle_create(self, request):
+        body = await _request_json(request)
+        b_id = _barcode(body.get('barcode'))
+        LOGGER.debug('Terminal %s creates %s', request['terminal'], b_id)
+        batch_id = await self.write(b_id, 'create')
+        return web.json_response({'barcode': b_id, 'batch_id': batch_id}, status=202)
+
+    async def handle_update(self, request):
+        b_id = _barcode(request.match_info['barcode'])
+        location = (await _request_json(request)).get('location')
+        if not isinstance(location, str) or not location or not is_valid_location(location):
+            raise GatewayError(400, 'Invalid location: {}'.format(location))
+        LOGGER.debug('Terminal %s moves %s to %s', request['terminal'], b_id, location)
+        if self._coalescer is not None:
+            self._coalescer.add(b_id, location)
+            return web.json_response({'barcode': b_id, 'location': location, 'coalesced': True}, status=202)
+        batch_id = await self.write(b_id, 'update', location)
+        return web.json_response({'barcode': b_id, 'location': location, 'batch_id': batch_id}, status=202)
+
+    async def handle_show(self, request):
+        b_id = _barcode(request.match_info['barcode'])
+        data = await self.read_state(b_id)
+        try:
+            product_name, mfg_date, location = parse_state_data(data)[re.sub('^0+', '', b_id)]
+        except (AttributeError, KeyError, ValueError):
+            raise GatewayError(404, 'Barcode not found: {}'.format(b_id))
+        hops = split_hops(location)
+        return web.json_response({'barcode': b_id, 'product_name': product_name, 'mfg_date': mfg_date,
+                                  'locations': [hop_location for hop_location, _ in hops],
+                                  'timestamps': [timestamp for _, timestamp in hops]})
+
+    @web.middleware
+    async def authenticate(self, request, handler):
+        terminal = self._terminal(request)
+        if terminal is None:
+            return web.json_response({'error': 'Unknown terminal'}, status=401,
+                                     headers={'WWW-Authenticate': 'Bearer'})
+        request['terminal'] = terminal
+        return await handler(request)
+
+    @web.middleware
+    async def errors(self, request, handler):
+        try:
+            return await handler(request)
+        except GatewayError as e:
+            return web.json_response({'error': str(e)}, status=e.status)
+        except aiohttp.ClientError as e:
+            return web.json_response({'error': 'REST API unavailable: {}'.format(e)}, status=503)
+
+    async def on_startup(self, app):
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self._connections))
+        if self._validator_url is not None:
+            self._cache.follow(self._validator_url)
+        # created here so its queue belongs to the loop the app runs on
+        self._writer = BatchWriter(self, window=self._window, max_batches=self._max_batches)
+        self._writer.start()
+        if self._coalesce_window:
+            # submits from its own thread through the blocking client
+            self._coalescer = HopCoalescer(self._client, window=self._coalesce_window).start()
+
+    async def on_cleanup(self, app):
+        if self._coalescer is not None:
+            await asyncio.get_event_loop().run_in_executor(None, self._coalescer.stop)
+        await self._writer.stop()
+        await self._session.close()
+
+    def make_app(self):
+        app = web.Application(middlewares=[self.authenticate, self.errors])
+        app.router.add_post('/barcodes', self.handle_create)
+        app.router.add_post('/barcodes/{barcode}/locations', self.handle_update)
+        app.router.add_get('/barcodes/{barcode}', self.handle_show)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+
+async def _request_json(request):
+    try:
+        body = await request.json()
+    except ValueError:
+        raise GatewayError(400, 'Request body must be JSON')
+    if not isinstance(body, dict):
+        raise GatewayError(400, 'Request body must be a JSON object')
+    return body
+
+
+def _barcode(b_id):
+    if not isinstance(b_id, str) or not b_id.isdigit():
+        raise GatewayError(400, 'Invalid barcode: {}'.format(b_id))
+    return b_id
+
+
+def load_tokens(path):
+    with open(path) as fd:
+        tokens = yaml.safe_load(fd) or {}
+    if not isinstance(tokens, dict) or not tokens:
+        raise Exception('{} must map every terminal name to its token'.format(path))
+    tokens = {str(terminal): str(token) for terminal, token in tokens.items()}
+    if len(set(tokens.values())) != len(tokens):
+        raise Exception('{} gives several terminals the same token'.format(path))
+    return tokens
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='HTTP gateway to the barcode transaction family')
+    parser.add_argument('--bind', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=5000, help='Port to listen on')
+    parser.add_argument('--url', default=DEFAULT_URL, help='REST API of the validator')
+    parser.add_argument('--validator', help='Validator endpoint to follow the chain head from block events')
+    parser.add_argument('--tenant', help='Tenant namespace to serve (default: the shared one)')
+    parser.add_argument('--tokens', required=True,
+                        help='YAML file mapping each terminal name to the bearer token it authenticates with')
+    signer = parser.add_mutually_exclusive_group(required=True)
+    signer.add_argument('-u', '--username', help='User whose key (~/.sawtooth/keys/<username>.priv) signs every write')
+    signer.add_argument('--keyfile', help='Signing key for every write')
+    parser.add_argument('--window', type=float, default=5.0,
+                        help='Milliseconds writes are collected into one BatchList')
+    parser.add_argument('--max-batches', type=int, default=100, help='Largest BatchList the gateway submits')
+    parser.add_argument('--connections', type=int, default=32, help='Pooled connections to the REST API')
+    parser.add_argument('--coalesce', type=float, default=0,
+                        help='Seconds location updates of one barcode are merged into one transaction (0: off)')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    opts = parse_args(args)
+    logging.basicConfig(level=logging.INFO)
+    keyfile = opts.keyfile or os.path.join(os.path.expanduser('~'), '.sawtooth', 'keys',
+                                           '{}.priv'.format(opts.username))
+    gateway = BarcodeGateway(opts.url, keyfile, load_tokens(opts.tokens), window=opts.window / 1000.0,
+                             max_batches=opts.max_batches, connections=opts.connections,
+                             validator_url=opts.validator, tenant=opts.tenant, coalesce_window=opts.coalesce)
+    web.run_app(gateway.make_app(), host=opts.bind, port=opts.port)
@@ -0,0 +1,209 @@
+import datetime
+import math
+import os
+import shelve
+import time
+from urllib.parse import urlsplit
+
+import yaml
+
+from sawtooth_barcode.addressing import is_barcode_family
+
+TIME_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M')
+
+# (top, bottom): every block from bottom up to top is in the index
+_RANGE_KEY = 'indexed_range'
+# bumped whenever indexed entries are computed differently, an older index is rebuilt
+_FORMAT_KEY = 'format'
+_FORMAT = 2
+_META_KEYS = (_RANGE_KEY, _FORMAT_KEY)
+
+
+def parse_point_in_time(at):
+    """Returns ('block', block_num) for a plain integer, ('time', epoch) for a date/time string."""
+    at = str(at).strip()
+    if at.isdigit():
+        return 'block', int(at)
+    for fmt in TIME_FORMATS:
+        try:
+            return 'time', time.mktime(datetime.datetime.strptime(at, fmt).timetuple())
+        except ValueError:
+            continue
+    raise Exception('Invalid --at value {}: expected a block number or a date like 2018-07-21[T10:30:00]'.format(at))
+
+
+def _txn_timestamp(txn_header):
+    # BarcodeClient uses time.time().hex() as the transaction nonce; other families' nonces mean anything
+    if not is_barcode_family(txn_header.get('family_name', '')):
+        return None
+    try:
+        timestamp = float.fromhex(txn_header.get('nonce', ''))
+    except (TypeError, ValueError):
+        return None
+    return timestamp if math.isfinite(timestamp) else None
+
+
+def _block_timestamp(block):
+    stamps = [_txn_timestamp(txn['header']) for batch in block.get('batches', [])
+              for txn in batch.get('transactions', [])]
+    stamps = [stamp for stamp in stamps if stamp is not None]
+    return max(stamps) if stamps else None
+
+
+def relative_suffix(url):
+    parts = urlsplit(url)
+    return '{}?{}'.format(parts.path.lstrip('/'), parts.query) if parts.query else parts.path.lstrip('/')
+
+
+def _sawtooth_dir_path(name):
+    return os.path.join(os.path.expanduser('~'), '.sawtooth', name)
+
+
+def _open_shelf(path):
+    shelf_dir = os.path.dirname(path)
+    if shelf_dir and not os.path.exists(shelf_dir):
+        os.makedirs(shelf_dir, 0o755)
+    return shelve.open(path)
+
+
+class BlockIndex(object):
+    """Maps block numbers and timestamps to block ids.
+
+    The index is kept in a shelve file together with the range of block
+    numbers it covers without gaps. Lookups inside that range are answered
+    without asking the REST API; otherwise refresh() pages only through the
+    blocks committed since the previous refresh, and resumes a first pass
+    that was interrupted before it reached the genesis block.
+    """
+
+    def __init__(self, client, path=None, page_size=100):
+        self._client = client
+        self._page_size = page_size
+        self._path = path if path is not None else _sawtooth_dir_path('barcode_block_index')
+
+    def _open(self):
+        index = _open_shelf(self._path)
+        if index.get(_FORMAT_KEY) != _FORMAT:
+            # timestamps of blocks indexed before only barcode nonces counted may be wrong
+            index.clear()
+            index[_FORMAT_KEY] = _FORMAT
+        return index
+
+    def _pages(self, suffix):
+        while suffix:
+            page = yaml.safe_load(self._client._send_request(suffix))
+            yield page['data']
+            next_url = page.get('paging', {}).get('next')
+            suffix = relative_suffix(next_url) if next_url else None
+
+    def refresh(self):
+        with self._open() as index:
+            top, bottom = index.get(_RANGE_KEY, (None, None))
+            head = lowest = None
+            joined = False
+            for blocks in self._pages('blocks?limit={}'.format(self._page_size)):
+                for block in blocks:
+                    block_num = int(block['header']['block_num'])
+                    block_id = block['header_signature']
+                    head = block_num if head is None else head
+                    known = index.get(str(block_num))
+                    if top is not None and bottom <= block_num <= top and known is not None and known[0] == block_id:
+                        # everything from here down to bottom was indexed by an earlier refresh
+                        joined = True
+                        break
+                    index[str(block_num)] = (block_id, _block_timestamp(block))
+                    lowest = block_num
+                if joined:
+                    break
+                if top is None and lowest is not None:
+                    # first pass, keep what was indexed if it gets interrupted
+                    index[_RANGE_KEY] = (head, lowest)
+            if head is None:
+                return
+            if not joined:
+                # paged all the way down to the genesis block
+                index[_RANGE_KEY] = (head, lowest if lowest is not None else 0)
+                return
+
+            index[_RANGE_KEY] = (head, bottom)
+            if bottom > 0:
+                # an earlier first pass stopped before the genesis block, continue below it
+                for blocks in self._pages('blocks?head={}&limit={}'.format(index[str(bottom)][0],
+                                                                           self._page_size)):
+                    for block in blocks:
+                        block_num = int(block['header']['block_num'])
+                        if block_num < bottom:
+                            index[str(block_num)] = (block['header_signature'], _block_timestamp(block))
+                            bottom = block_num
+                    index[_RANGE_KEY] = (head, bottom)
+
+    def _covers(self, index, block_num):
+        top, bottom = index.get(_RANGE_KEY, (None, None))
+        return top is not None and bottom == 0 and block_num <= top
+
+    def block_id(self, block_num):
+        with self._open() as index:
+            covered = self._covers(index, block_num)
+        if not covered:
+            self.refresh()
+        with self._open() as index:
+            known = index.get(str(block_num))
+        if known is None:
+            raise Exception('No block with number {}'.format(block_num))
+        return known[0]
+
+    def block_at_time(self, timestamp):
+        """Returns the id of the last block committed at or before timestamp.
+
+        Blocks carrying no barcode transactions inherit the timestamp of the
+        block before them.
+        """
+        with self._open() as index:
+            # a block stamped later than timestamp is already indexed, newer blocks can not change the answer
+            settled = index.get(_RANGE_KEY, (None, None))[1] == 0 and any(
+                entry[1] is not None and entry[1] > timestamp for num, entry in index.items() if num not in _META_KEYS)
+        if not settled:
+            self.refresh()
+        with self._open() as index:
+            blocks = sorted((int(num), entry) for num, entry in index.items() if num not in _META_KEYS)
+        found = None
+        last_stamp = None
+        for _, (block_id, stamp) in blocks:
+            if stamp is not None:
+                last_stamp = stamp
+            if last_stamp is not None and last_stamp > timestamp:
+                break
+            found = block_id
+        if found is None:
+            raise Exception('No block committed at or before {}'.format(time.ctime(timestamp)))
+        return found
+
+    def resolve(self, at):
+        kind, value = parse_point_in_time(at)
+        if kind == 'block':
+            return self.block_id(value)
+        return self.block_at_time(value)
+
+
+class StateArchive(object):
+    """State entries as of a given block, kept on disk.
+
+    State at a block id never changes, so an audit that was answered once is
+    answered again from ~/.sawtooth without going back to the validator, in
+    this process or any later one.
+    """
+
+    def __init__(self, path=None):
+        self._path = path if path is not None else _sawtooth_dir_path('barcode_state_archive')
+
+    def get(self, address, block_id):
+        """Returns (found, data); data is None for an address that was empty at that block."""
+        with _open_shelf(self._path) as archive:
+            key = '{}/{}'.format(block_id, address)
+            if key in archive:
+                return True, archive[key]
+        return False, None
+
+    def put(self, address, block_id, data):
+        with _open_shelf(self._path) as archive:
+            archive['{}/{}'.format(block_id, address)] = data
@@ -1,22 +1,66 @@
 import hashlib
 import logging
+import math
 import psycopg2
 import re
 
 from sawtooth_sdk.processor.handler import TransactionHandler
 from sawtooth_sdk.processor.exceptions import InvalidTransaction
 from sawtooth_sdk.processor.exceptions import InternalError
+from sawtooth_signing import ParseError
+from sawtooth_signing import create_context
+from sawtooth_signing.secp256k1 import Secp256k1PrivateKey
+
+from sawtooth_barcode.addressing import HOP_ACTIONS
+from sawtooth_barcode.addressing import family_tenant
+from sawtooth_barcode.addressing import make_head_address
+from sawtooth_barcode.addressing import make_role_address
+from sawtooth_barcode.addressing import make_role_registry_address
+from sawtooth_barcode.addressing import tenant_family
+from sawtooth_barcode.addressing import tenant_prefix
+from sawtooth_barcode.barcode_codec import LOCATION_SEPARATOR
+from sawtooth_barcode.barcode_codec import RESERVED_LOCATION_CHARS
+from sawtooth_barcode.barcode_codec import append_location
+from sawtooth_barcode.barcode_codec import decode_hops
+from sawtooth_barcode.barcode_codec import is_valid_location
+from sawtooth_barcode.barcode_codec import parse_state_data
+from sawtooth_barcode.barcode_codec import serialize_state_data
+from sawtooth_barcode.cache import LRUCache
+from sawtooth_barcode.processor.profiler import NullProfiler
+from sawtooth_barcode.processor.roles import PERMISSIONS
+from sawtooth_barcode.processor.roles import RoleCache
+from sawtooth_barcode.processor.roles import parse_user_record
+from sawtooth_barcode.processor.roles import store_role
+from sawtooth_barcode.provenance import GENESIS_DIGEST
+from sawtooth_barcode.provenance import hop_digest
+from sawtooth_barcode.provenance import parse_head
+from sawtooth_barcode.provenance import serialize_head
 
 LOGGER = logging.getLogger(__name__)
 
 
 class BarcodeTransactionHandler(TransactionHandler):
-    def __init__(self, namespace_prefix):
-        self._namespace_prefix = namespace_prefix
+    def __init__(self, tenant=None, state_cache_size=4096, profiler=None, role_cache=None, recorder=None,
+                 barcode_details=None):
+        # one handler per tenant, register several on a processor to serve a set of tenants
+        self.tenant = tenant
+        self._family_name = tenant_family(tenant)
+        self._namespace_prefix = tenant_prefix(tenant)
+        # event types are shared by every tenant, subscribers filter on this attribute
+        self._event_tenant = family_tenant(self._family_name)
+        # parsed barcode records keyed by (address, sha256 of the state bytes)
+        self._state_cache = LRUCache(maxsize=state_cache_size)
+        self._profiler = profiler if profiler is not None else NullProfiler()
+        # parsed roles keyed by the role record bytes, the record itself is read on every apply
+        self._role_cache = role_cache if role_cache is not None else RoleCache()
+        self._recorder = recorder
+        self._barcode_details = barcode_details if barcode_details is not None else _get_barcode_details
+        if recorder is not None:
+            self._barcode_details = recorder.wrap_barcode_details(self._barcode_details)
 
     @property
     def family_name(self):
-        return 'barcode'
+        return self._family_name
 
     @property
     def family_versions(self):
@@ -27,17 +71,49 @@ class BarcodeTransactionHandler(TransactionHandler):
         return [self._namespace_prefix]
 
     def apply(self, transaction, context):
+        if self._recorder is not None:
+            return self._recorder.record(self._profiled_apply, transaction, context)
+        return self._profiled_apply(transaction, context)
+
+    def _profiled_apply(self, transaction, context):
+        return self._profiler.run(self._apply, transaction, context)
+
+    def _apply(self, transaction, context):
+        profiler = self._profiler
 
         # 1. Deserialize the transaction and verify it is valid
-        b_id, action, upd_location, signer = _unpack_transaction(transaction)
+        with profiler.stage('unpack'):
+            b_id, action, upd_location, signer = _unpack_transaction(transaction)
 
         if action == 'add':
-            _add_priv_key(context, name=b_id, tag=upd_location.split(':')[0], priv_key=upd_location.split(':')[1],
+            try:
+                tag, priv_key = upd_location.split(':')
+            except ValueError:
+                raise InvalidTransaction('User payload should be <type>:<private key>')
+            public_key = _public_key_from_private(priv_key)
+            with profiler.stage('authorize'):
+                self._authorize_add(context, signer, b_id, tag, priv_key, public_key)
+            _add_priv_key(context, name=b_id, tag=tag, priv_key=priv_key,
                           namespace=self._namespace_prefix)
+            store_role(context, make_role_address(self._namespace_prefix, public_key), public_key, tag, b_id)
+            _emit_event(context, 'user/added', tenant=self._event_tenant, user=b_id, tag=tag, signer=signer)
             return
 
-        # 2. Retrieve the game data from state storage
-        product_name, mfg_date, location, barcode_list = _get_state_data(context, self._namespace_prefix, b_id)
+        # 2. Retrieve the item, the signer's role and the provenance head in one round trip
+        address = _make_xo_address(self._namespace_prefix, b_id)
+        role_address = make_role_address(self._namespace_prefix, signer)
+        head_address = make_head_address(self._namespace_prefix, b_id) if action in HOP_ACTIONS else None
+        with profiler.stage('state_get'):
+            state = _read_state(context, [address, role_address] + ([head_address] if head_address else []))
+
+        with profiler.stage('authorize'):
+            self._authorize(state.get(role_address), signer, action)
+
+        with profiler.stage('state_get'):
+            product_name, mfg_date, location, barcode_list = _decode_state_data(address, state.get(address), b_id,
+                                                                                cache=self._state_cache)
+            if head_address is not None:
+                digest, count = _decode_head(state.get(head_address))
 
         # 3. Validate the game data
         # _validate_game_data(
@@ -45,12 +121,40 @@ class BarcodeTransactionHandler(TransactionHandler):
         #     board, state, player1, player2)
         #
         # 4. Apply the transaction
+        hops = []
         if action == 'create':
-            barcode_list = _get_barcode_details(b_id)
+            # creating an item again would erase its history
+            if barcode_list:
+                raise InvalidTransaction('Barcode {} already exists'.format(b_id))
+            with profiler.stage('db_lookup'):
+                barcode_list = self._barcode_details(b_id)
+            if not barcode_list:
+                raise InvalidTransaction('Barcode {} is not in the catalog'.format(b_id))
+            # the chain starts with the catalog location
+            digest, count = GENESIS_DIGEST, 0
+            hops = [(list(barcode_list.values())[0][2], _transaction_time(transaction))]
+
+        elif action in ('update', 'move') and not barcode_list:
+            raise InvalidTransaction('Barcode {} does not exist'.format(b_id))
 
         if action == 'update':
-            product_name, mfg_date, location, barcode_list = _get_state_data(context, self._namespace_prefix, b_id,
-                                                                             upd_location)
+            hops = [(upd_location, _transaction_time(transaction))]
+
+        if action == 'move':
+            # several coalesced hops, applied in order with a single state write
+            hops = _decode_hops(upd_location)
+
+        if action in ('update', 'move'):
+            # every hop is stored with its time, events are not the only record of it
+            for hop_location, timestamp in hops:
+                barcode_list = append_location(barcode_list, hop_location, timestamp)
+
+        # advance the provenance chain by every hop recorded
+        digests = []
+        for hop_location, timestamp in hops:
+            digest = hop_digest(digest, hop_location, signer, timestamp)
+            digests.append(digest)
+        head = (head_address, serialize_head(digest, count + len(hops))) if hops else None
         # if action == 'delete':
         #     _delete_game(context, name, self._namespace_prefix)
         #     return
@@ -72,7 +176,99 @@ class BarcodeTransactionHandler(TransactionHandler):
         #             upd_board, upd_state, upd_player1, upd_player2, name))
 
         # 6. Put the game data back in state storage
-        _store_state_data(context, barcode_list, self._namespace_prefix, b_id)
+        _store_state_data(context, barcode_list, self._namespace_prefix, b_id, cache=self._state_cache,
+                          profiler=profiler, head=head)
+
+        # 7. Let subscribers know about the change instead of having them poll state. Each hop carries
+        # what a verifier needs to recompute the chain: signer, timestamp and the digest after the hop.
+        event_type = 'barcode/created' if action == 'create' else 'barcode/moved'
+        for (hop_location, timestamp), hop_digest_hex in zip(hops, digests):
+            _emit_event(context, event_type, tenant=self._event_tenant, barcode=b_id, location=hop_location,
+                        signer=signer, timestamp=repr(float(timestamp)), digest=hop_digest_hex)
+
+    def _authorize(self, role_data, signer, action):
+        role = self._role_cache.role(role_data)
+        if role not in PERMISSIONS[action]:
+            raise InvalidTransaction('Signer {} is not allowed to {} barcodes'.format(signer[:8], action))
+
+    def _authorize_add(self, context, signer, name, tag, priv_key, public_key):
+        """An admin adds any user; otherwise a signer may only register itself.
+
+        It may do so as the first admin of a new chain (barcode_cli setup), or
+        as a user registered before role records were kept, by re-adding its
+        own user record (barcode_cli migrate). An upgraded chain has no role
+        records yet, but it has the user record 'admin' written by setup, so
+        nobody can claim the first admin role of a chain already in use.
+        """
+        if tag not in ('admin', 'supplier'):
+            raise InvalidTransaction('Invalid user type: {}'.format(tag))
+
+        role_address = make_role_address(self._namespace_prefix, signer)
+        registry_address = make_role_registry_address(self._namespace_prefix)
+        user_address = _make_xo_address(self._namespace_prefix, name)
+        setup_address = _make_xo_address(self._namespace_prefix, 'admin')
+        state = _read_state(context, [role_address, registry_address, user_address, setup_address])
+        if self._role_cache.role(state.get(role_address)) in PERMISSIONS['add']:
+            return
+
+        if public_key != signer:
+            raise InvalidTransaction('Signer {} is not allowed to add users'.format(signer[:8]))
+        if parse_user_record(state.get(user_address)) == (name, tag, priv_key):
+            # registered before role records were kept, the record proves the role
+            pass
+        elif state.get(registry_address) or parse_user_record(state.get(setup_address)):
+            raise InvalidTransaction('Signer {} is not allowed to add users'.format(signer[:8]))
+        elif tag != 'admin':
+            raise InvalidTransaction('The first user must be an admin registering its own key')
+        if not state.get(registry_address):
+            addresses = context.set_state({registry_address: b'1'})
+            if len(addresses) < 1:
+                raise InternalError("State Error")
+
+
+def _transaction_time(transaction):
+    """Time of a 'create' or 'update' hop: the transaction nonce, float.hex() of a Unix time.
+
+    The nonce is part of the signed header, so the time is as trustworthy as
+    the signer, and it is hashed into the provenance chain. That makes the
+    nonce format part of the family's rules: a transaction whose nonce is not
+    such a time is invalid. txn_builder.make_transaction sets it; other
+    clients must do the same, or send hops as 'move', whose payload carries
+    each hop's time.
+    """
+    try:
+        timestamp = float.fromhex(transaction.header.nonce)
+    except (TypeError, ValueError):
+        raise InvalidTransaction('Nonce must carry the submission time')
+    if not math.isfinite(timestamp):
+        raise InvalidTransaction('Nonce must carry the submission time')
+    return timestamp
+
+
+def _decode_head(state_data):
+    try:
+        return parse_head(state_data)
+    except ValueError:
+        raise InternalError('Failed to deserialize provenance head.')
+
+
+def _decode_hops(encoded):
+    try:
+        hops = decode_hops(encoded)
+    except ValueError:
+        raise InvalidTransaction('Invalid hop list: {}'.format(encoded))
+    timestamps = [timestamp for _, timestamp in hops]
+    if timestamps != sorted(timestamps):
+        raise InvalidTransaction('Hops must be in timestamp order')
+    return hops
+
+
+def _public_key_from_private(priv_key):
+    try:
+        private_key = Secp256k1PrivateKey.from_hex(priv_key)
+    except ParseError:
+        raise InvalidTransaction('Invalid private key for user')
+    return create_context('secp256k1').get_public_key(private_key).as_hex()
 
 
 def _get_barcode_details(barcode):
@@ -90,6 +286,10 @@ def _get_barcode_details(barcode):
     return barcode_list
 
 
+def _emit_event(context, event_type, **attributes):
+    context.add_event(event_type=event_type, attributes=[(key, str(value)) for key, value in attributes.items()])
+
+
 def _add_priv_key(context, name, tag, priv_key, namespace):
     state_data = '|'.join([str(name), str(tag), str(priv_key), ]).encode()
     addresses = context.set_state(
@@ -126,41 +326,57 @@ def _validate_transaction(name, action, location):
     if not action:
         raise InvalidTransaction('Action is required')
 
-    if action not in ('create', 'update', 'show', 'add'):
+    if action not in ('create', 'update', 'move', 'show', 'add'):
         raise InvalidTransaction('Invalid action: {}'.format(action))
 
-    if action == 'update':
+    if action in ('update', 'move'):
         try:
             assert location is not None
         except (ValueError, AssertionError):
             raise InvalidTransaction('location should not be empty during update action')
 
+    # 'move' hops are checked one by one as they are decoded
+    if action == 'update' and not is_valid_location(location):
+        raise InvalidTransaction('Location cannot contain any of {}'.format(
+            ' '.join(RESERVED_LOCATION_CHARS + (LOCATION_SEPARATOR,))))
+
 
 def _make_xo_address(namespace_prefix, b_id):
     return namespace_prefix + hashlib.sha512(b_id.encode('utf-8')).hexdigest()[:64]
 
 
-def _get_state_data(context, namespace_prefix, b_id, upd_location=None):
-    # Get data from address
-    state_entries = context.get_state([_make_xo_address(namespace_prefix, b_id)])
-    append_location = ''
-    if upd_location is not None:
-        append_location = '-> {}'.format(upd_location)
-    # context.get_state() returns a list. If no data has been stored yet
-    # at the given address, it will be empty.
-    if state_entries:
-        try:
-            state_data = state_entries[0].data
+def _state_key(address, state_data):
+    return address, hashlib.sha256(state_data).digest()
+
+
+def _read_state(context, addresses):
+    # context.get_state() only returns entries for addresses that hold data
+    return {entry.address: entry.data for entry in context.get_state(addresses)}
 
-            barcode_list = {b_id: (product_name, mfg_date, location + append_location) for
-                            b_id, product_name, mfg_date, location in
-                            [barcode.split(',') for barcode in state_data.decode().split('|')]}
+
+def _get_state_data(context, namespace_prefix, b_id, cache=None):
+    address = _make_xo_address(namespace_prefix, b_id)
+    return _decode_state_data(address, _read_state(context, [address]).get(address), b_id, cache=cache)
+
+
+def _decode_state_data(address, state_data, b_id, cache=None):
+    if state_data:
+        key = _state_key(address, state_data) if cache is not None else None
+        barcode_list = cache.get(key) if cache is not None else None
+        try:
+            if barcode_list is None:
+                barcode_list = parse_state_data(state_data)
+                if cache is not None:
+                    cache.put(key, barcode_list)
 
             (product_name, mfg_date, location) = barcode_list[re.sub("^0+", "", b_id)]
 
         except ValueError:
             raise InternalError("Failed to deserialize game data.")
 
+        # cached records are shared, callers get their own copy to modify
+        barcode_list = dict(barcode_list)
+
     else:
         barcode_list = {}
         product_name = mfg_date = location = None
@@ -168,17 +384,23 @@ def _get_state_data(context, namespace_prefix, b_id, upd_location=None):
     return product_name, mfg_date, location, barcode_list
 
 
-def _store_state_data(context, barcode_list, namespace_prefix, b_id):
+def _store_state_data(context, barcode_list, namespace_prefix, b_id, cache=None, profiler=None, head=None):
+    profiler = profiler if profiler is not None else NullProfiler()
 
     # barcode_list[b_id] = product_name, mfg_date, location
-    # game_list[name] = board, state, player1, player2
-
-    state_data = '|'.join(sorted(
-        [','.join([str(idd), str(product_name), str(mfg_date), location]) for idd, (product_name, mfg_date, location) in
-         barcode_list.items()])).encode()
-    tate_data = '|'.join([str(name), str(tag), str(priv_key), ]).encode()
-    addresses = context.set_state(
-        {_make_xo_address(namespace_prefix, b_id): state_data})
+    address = _make_xo_address(namespace_prefix, b_id)
+    with profiler.stage('serialize'):
+        state_data = serialize_state_data(barcode_list)
+    entries = {address: state_data}
+    if head is not None:
+        # the provenance head goes out in the same round trip
+        entries[head[0]] = head[1]
+    with profiler.stage('state_set'):
+        addresses = context.set_state(entries)
 
     if len(addresses) < 1:
         raise InternalError("State Error")
+
+    # the next transaction touching this item reads exactly these bytes back
+    if cache is not None:
+        cache.put(_state_key(address, state_data), dict(barcode_list))
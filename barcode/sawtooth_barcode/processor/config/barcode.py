@@ -15,6 +15,10 @@ def load_default_xo_config():
     """
     return BarcodeConfig(
         connect='tcp://localhost:4004',
+        profile_every=0,
+        profile_mode='cprofile',
+        profile_dump_interval=60,
+        tenants=['default'],
     )
 
 
@@ -51,14 +55,18 @@ def load_toml_xo_config(filename):
 
     toml_config = toml.loads(raw_config)
     invalid_keys = set(toml_config.keys()).difference(
-        ['connect'])
+        ['connect', 'profile_every', 'profile_mode', 'profile_dump_interval', 'tenants'])
     if invalid_keys:
         raise LocalConfigurationError(
             "Invalid keys in transaction processor config: "
             "{}".format(", ".join(sorted(list(invalid_keys)))))
 
     config = BarcodeConfig(
-        connect=toml_config.get("connect", None)
+        connect=toml_config.get("connect", None),
+        profile_every=toml_config.get("profile_every", None),
+        profile_mode=toml_config.get("profile_mode", None),
+        profile_dump_interval=toml_config.get("profile_dump_interval", None),
+        tenants=toml_config.get("tenants", None)
     )
 
     return config
@@ -79,35 +87,80 @@ def merge_xo_config(configs):
             passed in configs.
     """
     connect = None
+    profile_every = None
+    profile_mode = None
+    profile_dump_interval = None
+    tenants = None
 
     for config in reversed(configs):
         if config.connect is not None:
             connect = config.connect
+        if config.profile_every is not None:
+            profile_every = config.profile_every
+        if config.profile_mode is not None:
+            profile_mode = config.profile_mode
+        if config.profile_dump_interval is not None:
+            profile_dump_interval = config.profile_dump_interval
+        if config.tenants is not None:
+            tenants = config.tenants
 
     return BarcodeConfig(
-        connect=connect
+        connect=connect,
+        profile_every=profile_every,
+        profile_mode=profile_mode,
+        profile_dump_interval=profile_dump_interval,
+        tenants=tenants
     )
 
 
 class BarcodeConfig:
-    def __init__(self, connect=None):
+    def __init__(self, connect=None, profile_every=None, profile_mode=None, profile_dump_interval=None,
+                 tenants=None):
         self._connect = connect
+        self._profile_every = profile_every
+        self._profile_mode = profile_mode
+        self._profile_dump_interval = profile_dump_interval
+        self._tenants = tenants
 
     @property
     def connect(self):
         return self._connect
 
+    @property
+    def profile_every(self):
+        return self._profile_every
+
+    @property
+    def profile_mode(self):
+        return self._profile_mode
+
+    @property
+    def profile_dump_interval(self):
+        return self._profile_dump_interval
+
+    @property
+    def tenants(self):
+        return self._tenants
+
     def __repr__(self):
         # not including  password for opentsdb
         return \
-            "{}(connect={})".format(
+            "{}(connect={}, profile_every={}, profile_mode={}, profile_dump_interval={}, tenants={})".format(
                 self.__class__.__name__,
                 repr(self._connect),
+                repr(self._profile_every),
+                repr(self._profile_mode),
+                repr(self._profile_dump_interval),
+                repr(self._tenants),
             )
 
     def to_dict(self):
         return collections.OrderedDict([
             ('connect', self._connect),
+            ('profile_every', self._profile_every),
+            ('profile_mode', self._profile_mode),
+            ('profile_dump_interval', self._profile_dump_interval),
+            ('tenants', self._tenants),
         ])
 
     def to_toml_string(self):
@@ -1,25 +1,141 @@
-import hashlib
+import argparse
+import signal
 import sys
 import os
 
 from sawtooth_sdk.processor.core import TransactionProcessor
 from sawtooth_sdk.processor.log import init_console_logging
 from sawtooth_sdk.processor.log import log_configuration
+from sawtooth_sdk.processor.config import get_config_dir
 from sawtooth_sdk.processor.config import get_log_dir
 from sawtooth_barcode.processor.barcode_handler import BarcodeTransactionHandler
+from sawtooth_barcode.processor.config.barcode import BarcodeConfig
+from sawtooth_barcode.processor.config.barcode import load_default_xo_config
+from sawtooth_barcode.processor.config.barcode import load_toml_xo_config
+from sawtooth_barcode.processor.config.barcode import merge_xo_config
+from sawtooth_barcode.processor.profiler import ApplyProfiler
+from sawtooth_barcode.processor.profiler import PROFILE_MODES
+from sawtooth_barcode.processor.recorder import TransactionRecorder
+from sawtooth_barcode.processor.recorder import replay
+from sawtooth_barcode.processor.roles import RoleCache
 
 
-def main():
+def parse_args(args):
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument(
+        '-C', '--connect',
+        help='Endpoint for the validator connection')
+
+    parser.add_argument(
+        '-v', '--verbose',
+        action='count',
+        default=2,
+        help='Increase output sent to stderr')
+
+    parser.add_argument(
+        '--tenant',
+        action='append',
+        dest='tenants',
+        help='Serve this tenant, repeat for several (default: tenants from barcode.toml, else the default tenant)')
+
+    parser.add_argument(
+        '--profile-every',
+        type=int,
+        help='Profile one in every N apply calls (0 disables, SIGUSR1 toggles at runtime)')
+
+    parser.add_argument(
+        '--profile-mode',
+        choices=PROFILE_MODES,
+        help='cprofile writes pstats dumps, stacks writes flamegraph folded stacks')
+
+    parser.add_argument(
+        '--record',
+        metavar='LOG',
+        help='Append every applied transaction and the state it read to LOG (gzip), for barcode_tp replay')
+
+    return parser.parse_args(args)
+
+
+def parse_replay_args(args):
+    parser = argparse.ArgumentParser(
+        prog='barcode_tp replay',
+        description='Run a transaction log recorded with --record through the handler offline')
+
+    parser.add_argument('log', help='Log written by barcode_tp --record')
+
+    parser.add_argument(
+        '--tenant',
+        help='Only replay the transactions of this tenant (default: every tenant in the log)')
+
+    parser.add_argument(
+        '-n', '--iterations',
+        type=int,
+        default=1,
+        help='Replay the log this many times, each time from empty state')
+
+    return parser.parse_args(args)
+
+
+def replay_main(args):
+    opts = parse_replay_args(args)
+    init_console_logging(verbose_level=1)
+    result = replay(lambda barcode_details, tenant: BarcodeTransactionHandler(tenant=tenant,
+                                                                              barcode_details=barcode_details),
+                    opts.log, iterations=opts.iterations, tenant=opts.tenant)
+    print("Replayed {transactions} transactions in {seconds:.3f}s: "
+          "{transactions_per_second:.0f} txn/s, {mismatches} mismatches".format(**result))
+    return 1 if result['mismatches'] else 0
+
+
+def load_barcode_config(first_config):
+    default_barcode_config = load_default_xo_config()
+    conf_file = os.path.join(get_config_dir(), 'barcode.toml')
+
+    toml_config = load_toml_xo_config(conf_file)
+
+    return merge_xo_config(
+        configs=[first_config, toml_config, default_barcode_config])
+
+
+def create_barcode_config(args):
+    return BarcodeConfig(
+        connect=args.connect,
+        profile_every=args.profile_every,
+        profile_mode=args.profile_mode,
+        tenants=args.tenants)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if args[:1] == ['replay']:
+        sys.exit(replay_main(args[1:]))
+    opts = parse_args(args)
 
     processor = None
+    recorder = None
     try:
-        processor = TransactionProcessor(url='tcp://127.0.0.1:4004')
+        barcode_config = load_barcode_config(create_barcode_config(opts))
+        processor = TransactionProcessor(url=barcode_config.connect)
         log_dir = get_log_dir()
         log_configuration(log_dir=log_dir, name="barcode-" + str(processor.zmq_id)[2:-1])
-        init_console_logging(verbose_level=2)
-        barcode_prefix = hashlib.sha512('barcode'.encode("utf-8")).hexdigest()[0:6]
-        handler = BarcodeTransactionHandler(namespace_prefix=barcode_prefix)
-        processor.add_handler(handler)
+        init_console_logging(verbose_level=opts.verbose)
+
+        profiler = ApplyProfiler(log_dir, every=barcode_config.profile_every, mode=barcode_config.profile_mode,
+                                 dump_interval=barcode_config.profile_dump_interval)
+        # SIGUSR1 switches sampling on/off, SIGUSR2 writes what was collected so far,
+        # both take effect on the next apply call
+        signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.request_toggle())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.request_dump())
+
+        # keyed by the role record bytes, so one role cache serves every tenant
+        role_cache = RoleCache()
+        recorder = TransactionRecorder(opts.record) if opts.record else None
+        for tenant in barcode_config.tenants:
+            handler = BarcodeTransactionHandler(tenant=tenant, profiler=profiler, role_cache=role_cache,
+                                                recorder=recorder)
+            processor.add_handler(handler)
         processor.start()
     except KeyboardInterrupt:
         pass
@@ -28,3 +144,5 @@ def main():
     finally:
         if processor is not None:
             processor.stop()
+        if recorder is not None:
+            recorder.close()
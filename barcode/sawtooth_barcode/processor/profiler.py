@@ -0,0 +1,195 @@
+import cProfile
+import collections
+import contextlib
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+STAGES = ('unpack', 'authorize', 'state_get', 'db_lookup', 'serialize', 'state_set')
+PROFILE_MODES = ('cprofile', 'stacks')
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class NullProfiler(object):
+    """Profiler stand-in used when profiling was never configured."""
+
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+    def run(self, func, *args):
+        return func(*args)
+
+
+class ApplyProfiler(object):
+    """Samples one in every `every` apply calls.
+
+    A sampled call is timed stage by stage and, depending on mode, run under
+    cProfile ('cprofile') or watched by a stack sampling thread ('stacks').
+    Every dump_interval seconds the accumulated data is written to log_dir:
+    a pstats file (open with snakeviz or python -m pstats) or folded stacks
+    (flamegraph.pl / speedscope input), plus a stage breakdown in the log.
+
+    Calls that are not sampled pay for a counter increment only. Profiling can
+    be switched on and off at runtime with toggle(). Signal handlers only
+    call request_toggle() / request_dump(), which set a flag; the next apply
+    call acts on it, so no file is written from inside a signal handler.
+    """
+
+    def __init__(self, log_dir, every=0, mode='cprofile', dump_interval=60, default_every=100,
+                 sample_interval=0.001):
+        if mode not in PROFILE_MODES:
+            raise ValueError('Invalid profile mode {}: expected one of {}'.format(mode, ', '.join(PROFILE_MODES)))
+        self._log_dir = log_dir
+        self.every = every
+        self.mode = mode
+        self._dump_interval = dump_interval
+        self._default_every = default_every
+        self._sample_interval = sample_interval
+        self._lock = threading.RLock()
+        self._calls = 0
+        self._sampling = False
+        self._sampled_thread = None
+        self._sampler = None
+        self._toggle_requested = False
+        self._dump_requested = False
+        self._reset()
+
+    @property
+    def enabled(self):
+        return self.every > 0
+
+    def _reset(self):
+        self._sampled_calls = 0
+        self._stage_seconds = collections.OrderedDict((stage, 0.0) for stage in STAGES)
+        self._total_seconds = 0.0
+        self._stats = None
+        self._stacks = collections.Counter()
+        self._last_dump = time.time()
+
+    def toggle(self):
+        with self._lock:
+            self.every = 0 if self.every else self._default_every
+        LOGGER.info('Apply profiling %s', 'enabled (1 in {})'.format(self.every) if self.every else 'disabled')
+        if not self.every:
+            self.dump()
+
+    def request_toggle(self):
+        # safe in a signal handler: no lock, no I/O
+        self._toggle_requested = True
+
+    def request_dump(self):
+        self._dump_requested = True
+
+    def _handle_requests(self):
+        if self._toggle_requested:
+            self._toggle_requested = False
+            self.toggle()
+        if self._dump_requested:
+            self._dump_requested = False
+            self.dump()
+
+    @contextlib.contextmanager
+    def _timed_stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._stage_seconds[name] += time.perf_counter() - start
+
+    def stage(self, name):
+        if not self._sampling or threading.get_ident() != self._sampled_thread:
+            return _NULL_STAGE
+        return self._timed_stage(name)
+
+    def run(self, func, *args):
+        if self._toggle_requested or self._dump_requested:
+            self._handle_requests()
+        self._calls += 1
+        if not self.every or self._calls % self.every:
+            return func(*args)
+
+        self._sampled_thread = threading.get_ident()
+        self._sampling = True
+        start = time.perf_counter()
+        try:
+            if self.mode == 'cprofile':
+                profile = cProfile.Profile()
+                try:
+                    return profile.runcall(func, *args)
+                finally:
+                    if self._stats is None:
+                        self._stats = pstats.Stats(profile)
+                    else:
+                        self._stats.add(profile)
+            else:
+                self._ensure_sampler()
+                return func(*args)
+        finally:
+            self._sampling = False
+            self._total_seconds += time.perf_counter() - start
+            self._sampled_calls += 1
+            if time.time() - self._last_dump >= self._dump_interval:
+                self.dump()
+
+    def _ensure_sampler(self):
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample_stacks, name='apply-stack-sampler')
+            self._sampler.daemon = True
+            self._sampler.start()
+
+    def _sample_stacks(self):
+        while True:
+            time.sleep(self._sample_interval)
+            if not self._sampling:
+                continue
+            frame = sys._current_frames().get(self._sampled_thread)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                # dump() iterates and replaces the counter under the same lock
+                with self._lock:
+                    self._stacks[';'.join(reversed(stack))] += 1
+
+    def dump(self):
+        with self._lock:
+            if not self._sampled_calls:
+                return
+            stamp = time.strftime('%Y%m%d-%H%M%S')
+            base = os.path.join(self._log_dir, 'barcode-profile-{}-{}'.format(os.getpid(), stamp))
+            try:
+                if self._stats is not None:
+                    self._stats.dump_stats(base + '.prof')
+                if self._stacks:
+                    with open(base + '.folded', 'w') as fd:
+                        for stack, count in sorted(self._stacks.items()):
+                            fd.write('{} {}\n'.format(stack, count))
+            except IOError as e:
+                LOGGER.warning('Unable to write profile dump %s: %s', base, e)
+
+            breakdown = ', '.join('{}={:.3f}ms'.format(stage, seconds * 1000 / self._sampled_calls)
+                                  for stage, seconds in self._stage_seconds.items())
+            LOGGER.info('Profiled %s of %s apply calls, %.3fms per call: %s (written to %s.*)',
+                        self._sampled_calls, self._calls, self._total_seconds * 1000 / self._sampled_calls,
+                        breakdown, base)
+            self._reset()
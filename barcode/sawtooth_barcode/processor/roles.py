@@ -0,0 +1,65 @@
+from sawtooth_sdk.processor.exceptions import InternalError
+
+from sawtooth_barcode.cache import LRUCache
+
+# roles allowed to submit each action
+PERMISSIONS = {
+    'add': ('admin',),
+    'create': ('admin',),
+    'update': ('admin', 'supplier'),
+    'move': ('admin', 'supplier'),
+    'show': ('admin', 'supplier'),
+}
+
+
+def serialize_role(public_key, role, name):
+    return ','.join([public_key, role, name]).encode()
+
+
+def parse_role(state_data):
+    try:
+        _, role, _ = state_data.decode().split(',')
+    except ValueError:
+        raise InternalError('Failed to deserialize role data.')
+    return role
+
+
+def parse_user_record(state_data):
+    """(name, tag, private key) of a user record at the address of its name, None for anything else.
+
+    Processors before role records existed only kept these; a registered
+    user migrates by submitting 'add' of its own record (barcode_cli migrate).
+    """
+    if not state_data:
+        return None
+    fields = state_data.decode().split('|')
+    return tuple(fields) if len(fields) == 3 else None
+
+
+def store_role(context, address, public_key, role, name):
+    addresses = context.set_state({address: serialize_role(public_key, role, name)})
+    if len(addresses) < 1:
+        raise InternalError("State Error")
+
+
+class RoleCache(object):
+    """Parsed roles keyed by the role record bytes read from state.
+
+    The handler always reads the role address through the context, in the
+    same get_state call as the item, so whether a transaction is valid only
+    ever depends on the state it is applied to. The cache saves the parsing;
+    a changed role is a different key, so nothing has to be invalidated.
+    """
+
+    def __init__(self, maxsize=4096):
+        self._cache = LRUCache(maxsize=maxsize)
+
+    def role(self, state_data):
+        """Role stored in state_data, None for a signer without a role record."""
+        if not state_data:
+            return None
+        role = self._cache.get(state_data)
+        if role is None:
+            role = parse_role(state_data)
+            self._cache.put(state_data, role)
+        return role
@@ -0,0 +1,60 @@
+"""Rolling hash chain over the hops of a barcode.
+
+The processor keeps a small head record per barcode, 'digest,count', next to
+the item record. Every recorded hop advances it:
+
+    digest = sha256(previous digest | location | signer | timestamp)
+
+starting from GENESIS_DIGEST. A verifier holding a claimed list of hops
+(from barcode/moved events, a supplier's records, ...) recomputes the chain
+and compares it with the head, without fetching or parsing the location
+string. Hops recorded before the head record existed are not covered.
+
+'create' starts the chain from GENESIS_DIGEST with the catalog location as
+its first hop; an item can only be created once, so its chain is never
+reset, and hops of an item that was never created are rejected. The timestamp of a 'move' hop comes from the payload, that
+of a 'create' or 'update' hop from the transaction nonce, which clients set
+to float.hex() of the submission time (see txn_builder.make_transaction).
+"""
+import hashlib
+
+GENESIS_DIGEST = '0' * 64
+
+
+def hop_digest(previous, location, signer, timestamp):
+    # '|' can not occur in a location, so the encoding is unambiguous
+    data = '|'.join([previous, location, signer, repr(float(timestamp))])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def fold_hops(digest, hops):
+    """Advances digest over hops given as (location, signer, timestamp)."""
+    for location, signer, timestamp in hops:
+        digest = hop_digest(digest, location, signer, timestamp)
+    return digest
+
+
+def serialize_head(digest, count):
+    return '{},{}'.format(digest, count).encode()
+
+
+def parse_head(data):
+    if not data:
+        return GENESIS_DIGEST, 0
+    digest, count = data.decode().split(',')
+    return digest, int(count)
+
+
+def verify_history(hops, head_digest, head_count):
+    """True if hops is exactly the history the head was built from."""
+    return len(hops) == head_count and fold_hops(GENESIS_DIGEST, hops) == head_digest
+
+
+def verify_inclusion(previous_digest, hop, following_hops, head_digest):
+    """True if hop was recorded right after previous_digest and following_hops led to the head.
+
+    previous_digest is the digest published with the preceding hop (the
+    'digest' attribute of its barcode/moved event), so a single hop is
+    checked without the history before it.
+    """
+    return fold_hops(hop_digest(previous_digest, *hop), following_hops) == head_digest
@@ -0,0 +1,53 @@
+import random
+import threading
+import time
+
+
+class QueueFullError(Exception):
+    """The REST API answered 429: the validator's batch queue is full."""
+
+
+class RateController(object):
+    """Paces batch submissions with additive-increase/multiplicative-decrease.
+
+    Every accepted submission raises the allowed rate by roughly `increase`
+    submissions per second each second; every queue-full answer multiplies it
+    by `decrease`. Sustained load therefore oscillates just under what the
+    validator can absorb instead of overrunning its queue.
+    """
+
+    def __init__(self, initial_rate=20.0, min_rate=0.5, max_rate=500.0, increase=1.0, decrease=0.5):
+        self.rate = initial_rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.queue_full_count = 0
+        self.submitted_count = 0
+        self._next_slot = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1.0 / self.rate
+        if slot > now:
+            time.sleep(slot - now)
+
+    def on_success(self):
+        with self._lock:
+            self.submitted_count += 1
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_queue_full(self):
+        with self._lock:
+            self.queue_full_count += 1
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # drop slots handed out at the old rate
+            self._next_slot = time.time() + 1.0 / self.rate
+
+
+def backoff_delay(attempt, base=0.2, cap=10.0):
+    # "full jitter": spreads retries of stations that were rejected together
+    return random.uniform(0, min(cap, base * 2 ** attempt))
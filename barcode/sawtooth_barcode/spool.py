@@ -0,0 +1,285 @@
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from sawtooth_sdk.protobuf.batch_pb2 import Batch
+from sawtooth_sdk.protobuf.batch_pb2 import BatchList
+
+from sawtooth_barcode.rate_control import QueueFullError
+from sawtooth_barcode.rate_control import backoff_delay
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_SPOOL_PATH = os.path.join(os.path.expanduser('~'), '.sawtooth', 'barcode_spool.db')
+
+QUEUED = 'queued'
+SUBMITTED = 'submitted'
+INVALID = 'invalid'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batches (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT NOT NULL UNIQUE,
+    data BLOB NOT NULL,
+    state TEXT NOT NULL,
+    queued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS batches_state ON batches (state, seq);
+CREATE TABLE IF NOT EXISTS barcode_heads (
+    family TEXT NOT NULL,
+    barcode TEXT NOT NULL,
+    txn_id TEXT NOT NULL,
+    batch_id TEXT NOT NULL,
+    PRIMARY KEY (family, barcode)
+);
+CREATE INDEX IF NOT EXISTS barcode_heads_batch ON barcode_heads (batch_id);
+CREATE TABLE IF NOT EXISTS batch_dependencies (
+    batch_id TEXT NOT NULL,
+    depends_on TEXT NOT NULL,
+    PRIMARY KEY (batch_id, depends_on)
+);
+CREATE INDEX IF NOT EXISTS batch_dependencies_depends_on ON batch_dependencies (depends_on);
+"""
+
+
+class ConnectionFailedError(Exception):
+    """The REST API could not be reached at all, as opposed to answering with an error."""
+
+
+class BatchRefusedError(Exception):
+    """The REST API answered with a client error (4xx), sending the same request again can not succeed."""
+
+
+class BatchSpool(object):
+    """Write-ahead spool of signed batches in a local SQLite database (WAL mode).
+
+    A batch is committed to disk before anything is sent, so a scan survives
+    a dead link or a restart. drain() submits everything queued, oldest
+    first, as one large BatchList and later removes batches once the
+    validator reports them COMMITTED; batches the validator lost are queued
+    again and INVALID ones are kept for inspection.
+
+    Ordering per barcode is enforced by the validator itself: the client
+    makes every spooled transaction depend on the previous transaction
+    spooled for the same barcode of the same family (last_transaction()),
+    so resubmissions and bulk drains can never apply two hops of one barcode
+    out of order. Such a batch can never commit once the batch it depends on
+    was rejected, so it is marked invalid along with it.
+
+    If the REST API refuses a BatchList with a client error (BatchRefusedError),
+    its batches are sent one by one and those refused on their own are marked
+    invalid, so one bad batch does not hold back the rest of the spool. Any
+    other failure, a connection error, a timeout or a 5xx answer such as the
+    503 of a REST API that can not reach its validator, leaves the batches
+    queued for the next drain.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_SPOOL_PATH
+        spool_dir = os.path.dirname(self.path)
+        if spool_dir and not os.path.exists(spool_dir):
+            os.makedirs(spool_dir, 0o755)
+        self._db = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        # an fsync per spooled batch, a scan that was acknowledged is never lost
+        self._db.execute('PRAGMA synchronous=FULL')
+        self._db.executescript(_SCHEMA)
+        self.lock = threading.RLock()
+
+    def close(self):
+        with self.lock:
+            self._db.close()
+
+    @contextlib.contextmanager
+    def _write(self):
+        with self.lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def last_transaction(self, family, b_id):
+        with self.lock:
+            row = self._db.execute('SELECT txn_id FROM barcode_heads WHERE family = ? AND barcode = ?',
+                                   (family, b_id)).fetchone()
+        return row[0] if row else None
+
+    def append(self, family, batch, barcode_txns):
+        """Persists a signed batch; barcode_txns maps each barcode it touches to its transaction id."""
+        self.append_many(family, [(batch, barcode_txns)])
+
+    def append_many(self, family, batches):
+        """Persists several (batch, barcode_txns) in one transaction, a single fsync for all of them."""
+        with self._write():
+            for batch, barcode_txns in batches:
+                batch_id = batch.header_signature
+                self._db.execute(
+                    'INSERT OR IGNORE INTO batches (batch_id, data, state, queued_at) VALUES (?, ?, ?, ?)',
+                    (batch_id, batch.SerializeToString(), QUEUED, time.time()))
+                for b_id, txn_id in barcode_txns.items():
+                    # the client made txn_id depend on the barcode's previous spooled transaction
+                    self._db.execute(
+                        'INSERT OR IGNORE INTO batch_dependencies (batch_id, depends_on) '
+                        'SELECT ?, batch_id FROM barcode_heads WHERE family = ? AND barcode = ? AND batch_id != ?',
+                        (batch_id, family, b_id, batch_id))
+                    self._db.execute(
+                        'INSERT OR REPLACE INTO barcode_heads (family, barcode, txn_id, batch_id) VALUES (?, ?, ?, ?)',
+                        (family, b_id, txn_id, batch_id))
+
+    def _set_state(self, batch_ids, state, error=None):
+        self._db.executemany('UPDATE batches SET state = ?, last_error = ? WHERE batch_id = ?',
+                             [(state, error, batch_id) for batch_id in batch_ids])
+
+    def _invalidate(self, batch_ids, error):
+        """Marks batch_ids and every spooled batch depending on them, directly or not, invalid."""
+        pending = [(batch_id, error) for batch_id in batch_ids]
+        while pending:
+            batch_id, error = pending.pop()
+            self._set_state([batch_id], INVALID, error)
+            # later hops must not depend on a transaction that will never be committed
+            self._db.execute('DELETE FROM barcode_heads WHERE batch_id = ?', (batch_id,))
+            dependents = [row[0] for row in self._db.execute(
+                'SELECT batch_id FROM batch_dependencies WHERE depends_on = ?', (batch_id,))]
+            self._db.execute('DELETE FROM batch_dependencies WHERE depends_on = ?', (batch_id,))
+            pending.extend((dependent, 'depends on rejected batch {}'.format(batch_id)) for dependent in dependents)
+
+    def _committed(self, batch_ids):
+        rows = [(batch_id,) for batch_id in batch_ids]
+        self._db.executemany('DELETE FROM batches WHERE batch_id = ?', rows)
+        self._db.executemany('DELETE FROM barcode_heads WHERE batch_id = ?', rows)
+        self._db.executemany('DELETE FROM batch_dependencies WHERE batch_id = ? OR depends_on = ?',
+                             [(batch_id, batch_id) for batch_id in batch_ids])
+
+    def _submit_queued(self, client, max_batches):
+        with self.lock:
+            rows = self._db.execute('SELECT batch_id, data FROM batches WHERE state = ? ORDER BY seq LIMIT ?',
+                                    (QUEUED, max_batches)).fetchall()
+        if not rows:
+            return 0, 0
+        return len(rows), self._send(client, [(batch_id, Batch.FromString(data)) for batch_id, data in rows])
+
+    def _state(self, batch_id):
+        with self.lock:
+            row = self._db.execute('SELECT state FROM batches WHERE batch_id = ?', (batch_id,)).fetchone()
+        return row[0] if row else None
+
+    def _send(self, client, batches):
+        """Sends batches, returns how many of them the REST API accepted."""
+        batch_ids = [batch_id for batch_id, _ in batches]
+        try:
+            client.send_batch_list(BatchList(batches=[batch for _, batch in batches]))
+        except BatchRefusedError as e:
+            if len(batches) > 1:
+                # find the batch the REST API objects to, the others go through
+                return sum(self._send(client, [batch]) for batch in batches
+                           if self._state(batch[0]) == QUEUED)
+            LOGGER.warning('Batch %s refused by the REST API: %s', batch_ids[0], e)
+            with self._write():
+                self._invalidate(batch_ids, 'refused by the REST API: {}'.format(e))
+            return 0
+        except Exception as e:
+            # nothing says the batches are at fault, keep them for the next drain
+            with self._write():
+                self._db.executemany('UPDATE batches SET attempts = attempts + 1, last_error = ? WHERE batch_id = ?',
+                                     [(str(e), batch_id) for batch_id in batch_ids])
+            raise
+        with self._write():
+            self._set_state(batch_ids, SUBMITTED)
+        return len(batches)
+
+    def _settle_submitted(self, client, chunk_size=50):
+        with self.lock:
+            batch_ids = [row[0] for row in self._db.execute(
+                'SELECT batch_id FROM batches WHERE state = ? ORDER BY seq', (SUBMITTED,))]
+        committed = 0
+        for start in range(0, len(batch_ids), chunk_size):
+            statuses = client.get_batch_statuses(batch_ids[start:start + chunk_size], 0)
+            by_status = {}
+            for batch_id, status in statuses.items():
+                by_status.setdefault(status, []).append(batch_id)
+            with self._write():
+                done = by_status.get('COMMITTED', [])
+                self._committed(done)
+                self._invalidate(by_status.get('INVALID', []), 'rejected by the validator')
+                # the validator restarted or dropped them, send them again
+                self._set_state(by_status.get('UNKNOWN', []), QUEUED)
+            committed += len(done)
+        return committed
+
+    def drain(self, client, max_batches=500):
+        """Submits queued batches and settles submitted ones. Returns (submitted, committed).
+
+        Raises ConnectionFailedError, QueueFullError or the REST API's error if the queued batches could
+        not be sent; batches refused with a client error are marked invalid instead.
+        """
+        submitted = 0
+        while True:
+            count, sent = self._submit_queued(client, max_batches)
+            submitted += sent
+            if count < max_batches:
+                break
+        return submitted, self._settle_submitted(client)
+
+    def status(self):
+        with self.lock:
+            counts = dict(self._db.execute('SELECT state, COUNT(*) FROM batches GROUP BY state').fetchall())
+            oldest = self._db.execute('SELECT MIN(queued_at) FROM batches WHERE state != ?', (INVALID,)).fetchone()[0]
+            barcodes = self._db.execute('SELECT COUNT(*) FROM barcode_heads').fetchone()[0]
+            last_error = self._db.execute(
+                'SELECT last_error FROM batches WHERE last_error IS NOT NULL ORDER BY seq DESC LIMIT 1').fetchone()
+        return {
+            QUEUED: counts.get(QUEUED, 0),
+            SUBMITTED: counts.get(SUBMITTED, 0),
+            INVALID: counts.get(INVALID, 0),
+            'barcodes': barcodes,
+            'oldest_age': time.time() - oldest if oldest is not None else None,
+            'last_error': last_error[0] if last_error else None,
+        }
+
+
+class SpoolDrainer(object):
+    """Background thread draining a BatchSpool, backing off while the validator is unreachable."""
+
+    def __init__(self, spool, client, interval=1.0):
+        self._spool = spool
+        self._client = client
+        self._interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        attempt = 0
+        while not self._stop_event.is_set():
+            try:
+                self._spool.drain(self._client)
+                attempt = 0
+                delay = self._interval
+            except (ConnectionFailedError, QueueFullError) as e:
+                LOGGER.info('Spool drain deferred: %s', e)
+                delay = max(self._interval, backoff_delay(attempt))
+                attempt += 1
+            except Exception:  # pylint: disable=broad-except
+                # a 5xx from the REST API and the like, the batches stay queued
+                LOGGER.exception('Spool drain failed')
+                delay = max(self._interval, backoff_delay(attempt))
+                attempt += 1
+            self._stop_event.wait(delay)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='spool-drainer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,118 @@
+import threading
+import time
+
+from sawtooth_barcode.cache import LRUCache
+from sawtooth_barcode.events import BarcodeEventSubscriber
+
+
+class ClientStateCache(object):
+    """Read cache of state entries keyed by (address, head block id).
+
+    An entry read at a given head never changes, so a read is served locally
+    as long as the chain head has not moved. The head costs no request of its
+    own: a read made while no head is known goes out unpinned, and the head
+    its answer names is trusted for head_ttl seconds, or kept current by a
+    block-commit subscription (follow()).
+
+    Writes made through this process are overlaid on reads until their batch
+    leaves PENDING, so a kiosk sees its own update immediately instead of the
+    state of the last committed block.
+    """
+
+    def __init__(self, maxsize=4096, head_ttl=0.5):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._latest = LRUCache(maxsize=maxsize)
+        self._overlay = {}
+        self._head_ttl = head_ttl
+        self._head = None
+        self._head_checked = 0.0
+        self._following = False
+        self._lock = threading.Lock()
+
+    def fresh_head(self):
+        """The cached head if it is still current, else None."""
+        with self._lock:
+            if self._head is not None and (self._following or time.time() - self._head_checked < self._head_ttl):
+                return self._head
+        return None
+
+    def set_head(self, head):
+        with self._lock:
+            self._head = head
+            self._head_checked = time.time()
+
+    def _forget_head(self):
+        with self._lock:
+            self._head = None
+
+    def follow(self, validator_url):
+        """Tracks the head from block-commit events instead of polling."""
+
+        def watch():
+            while True:
+                try:
+                    with BarcodeEventSubscriber(url=validator_url, event_types=()) as subscriber:
+                        self._following = True
+                        for event in subscriber.events(include_block_commits=True):
+                            if event['event_type'] == 'sawtooth/block-commit':
+                                self.set_head(event['attributes']['block_id'])
+                except Exception:  # pylint: disable=broad-except
+                    self._following = False
+                    time.sleep(5)
+
+        thread = threading.Thread(target=watch, name='state-cache-head')
+        thread.daemon = True
+        thread.start()
+
+    def get(self, address, head):
+        return self._entries.get((address, head))
+
+    def put(self, address, head, data):
+        self._entries.put((address, head), data)
+        self._latest.put(address, data)
+
+    def latest(self, address):
+        return self._latest.get(address)
+
+    def add_overlay(self, address, batch_id, data):
+        with self._lock:
+            self._overlay[address] = (batch_id, data)
+
+    def pending_or_latest(self, address):
+        with self._lock:
+            pending = self._overlay.get(address)
+        if pending is not None:
+            return pending[1]
+        latest = self._latest.get(address)
+        return latest[0] if latest is not None else None
+
+    def overlay(self, client, address):
+        with self._lock:
+            pending = self._overlay.get(address)
+        if pending is None:
+            return None
+        batch_id, data = pending
+        try:
+            status = client._get_status(batch_id, 0)
+        except Exception:  # pylint: disable=broad-except
+            status = 'UNKNOWN'
+        if status == 'PENDING':
+            return data
+        with self._lock:
+            if self._overlay.get(address) == pending:
+                del self._overlay[address]
+        # the batch made it into a block the cached head may predate
+        self._forget_head()
+        return None
+
+
+_SHARED_CACHES = {}
+_SHARED_CACHES_LOCK = threading.Lock()
+
+
+def shared_state_cache(base_url):
+    """One cache per REST API endpoint, shared by every BarcodeClient in the process."""
+    with _SHARED_CACHES_LOCK:
+        if base_url not in _SHARED_CACHES:
+            _SHARED_CACHES[base_url] = ClientStateCache()
+        return _SHARED_CACHES[base_url]
@@ -0,0 +1,210 @@
+import logging
+import queue
+import threading
+import time
+
+import pygame
+import pygame.camera
+import pygame.image
+
+from sawtooth_barcode.barcode_reader import BarcodeReader
+from sawtooth_barcode.barcode_reader import image_to_array
+from sawtooth_barcode.rate_control import backoff_delay
+
+LOGGER = logging.getLogger(__name__)
+
+_CAMERA_INIT_LOCK = threading.Lock()
+
+
+class CameraSource(object):
+    """Grabs frames from one video device without the interactive preview."""
+
+    def __init__(self, cam_name, cam_resolution=(640, 480), interval=0.2):
+        self.name = cam_name
+        self._cam_resolution = cam_resolution
+        self._interval = interval
+        self._cam = None
+
+    def open(self):
+        with _CAMERA_INIT_LOCK:
+            pygame.camera.init()
+            self._cam = pygame.camera.Camera(self.name, self._cam_resolution)
+        self._cam.start()
+
+    def close(self):
+        if self._cam is not None:
+            self._cam.stop()
+            self._cam = None
+
+    def frames(self, stop_event):
+        while not stop_event.is_set():
+            yield image_to_array(self._cam.get_image())
+            time.sleep(self._interval)
+
+
+class FileSource(object):
+    """Stand-in camera that replays image files, for tests and dry runs."""
+
+    def __init__(self, paths, interval=0.0, loop=False):
+        self.name = 'file:{}'.format(','.join(paths))
+        self._paths = paths
+        self._interval = interval
+        self._loop = loop
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def frames(self, stop_event):
+        while not stop_event.is_set():
+            for path in self._paths:
+                if stop_event.is_set():
+                    return
+                yield image_to_array(pygame.image.load(path))
+                time.sleep(self._interval)
+            if not self._loop:
+                return
+
+
+class DedupQueue(object):
+    """Queue of scanned barcodes that drops repeats seen within ttl seconds.
+
+    Several cameras usually see the same parcel, and one camera sees it in
+    many consecutive frames; only the first sighting is queued.
+    """
+
+    def __init__(self, ttl=5.0):
+        self._ttl = ttl
+        self._queue = queue.Queue()
+        self._last_seen = {}
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def put(self, barcode):
+        now = time.time()
+        with self._lock:
+            seen = self._last_seen.get(barcode)
+            self._last_seen[barcode] = now
+            if seen is not None and now - seen < self._ttl:
+                self.duplicates += 1
+                return False
+            if len(self._last_seen) > 10000:
+                self._last_seen = {code: stamp for code, stamp in self._last_seen.items()
+                                   if now - stamp < self._ttl}
+        self._queue.put(barcode)
+        return True
+
+    def requeue(self, barcodes):
+        """Queues barcodes again whose submission failed, bypassing the repeat check."""
+        for barcode in barcodes:
+            self._queue.put(barcode)
+
+    def forget(self, barcodes):
+        """Lets the next scan of barcodes through at once, e.g. after they were given up."""
+        with self._lock:
+            for barcode in barcodes:
+                self._last_seen.pop(barcode, None)
+
+    def get(self, timeout=None):
+        return self._queue.get(timeout=timeout)
+
+    def empty(self):
+        return self._queue.empty()
+
+
+class ScanStation(object):
+    """Runs one capture thread per source and a single submitter thread.
+
+    submit is called with a list of distinct barcodes, at most max_batch long,
+    at least every `window` seconds while scans keep coming in. When it
+    raises, the barcodes are queued again and retried with backoff; only
+    the ones still failing when the station stops are given up (counted in
+    `lost` and forgotten by the dedup queue, so a re-scan goes through).
+    """
+
+    def __init__(self, sources, submit, window=0.5, max_batch=50, dedup_ttl=5.0, reader_factory=BarcodeReader):
+        self._sources = sources
+        self._submit = submit
+        self._window = window
+        self._max_batch = max_batch
+        self._reader_factory = reader_factory
+        self.queue = DedupQueue(ttl=dedup_ttl)
+        self._stop_event = threading.Event()
+        self._capture_threads = []
+        self._submitter = None
+        self.submitted = 0
+        self.lost = 0
+
+    def _capture(self, source):
+        reader = self._reader_factory(cam_name=source.name)
+        try:
+            source.open()
+            for frame in source.frames(self._stop_event):
+                for barcode in reader.decode(frame):
+                    if self.queue.put(barcode):
+                        LOGGER.info('%s read barcode %s', source.name, barcode)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception('Capture from %s failed', source.name)
+        finally:
+            source.close()
+
+    def _collect(self):
+        barcodes = []
+        deadline = None
+        while len(barcodes) < self._max_batch:
+            timeout = 0.1 if deadline is None else max(0.0, deadline - time.time())
+            try:
+                barcodes.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                if deadline is not None or self._stop_event.is_set():
+                    break
+                continue
+            if deadline is None:
+                deadline = time.time() + self._window
+        return barcodes
+
+    def _run_submitter(self):
+        attempt = 0
+        while not (self._stop_event.is_set() and self.queue.empty()):
+            barcodes = self._collect()
+            if not barcodes:
+                continue
+            try:
+                self._submit(barcodes)
+                self.submitted += len(barcodes)
+                attempt = 0
+            except Exception:  # pylint: disable=broad-except
+                if self._stop_event.is_set():
+                    LOGGER.exception('Failed to submit %s, giving them up', ', '.join(barcodes))
+                    self.lost += len(barcodes)
+                    self.queue.forget(barcodes)
+                    continue
+                LOGGER.exception('Failed to submit %s, retrying', ', '.join(barcodes))
+                self.queue.requeue(barcodes)
+                self._stop_event.wait(backoff_delay(attempt))
+                attempt += 1
+
+    def start(self):
+        for source in self._sources:
+            thread = threading.Thread(target=self._capture, args=(source,), name='capture-' + source.name)
+            thread.daemon = True
+            thread.start()
+            self._capture_threads.append(thread)
+        self._submitter = threading.Thread(target=self._run_submitter, name='submitter')
+        self._submitter.daemon = True
+        self._submitter.start()
+
+    def wait(self):
+        """Blocks until every source is exhausted (file sources) and the queue is drained."""
+        for thread in self._capture_threads:
+            thread.join()
+        self.stop()
+
+    def stop(self):
+        self._stop_event.set()
+        for thread in self._capture_threads:
+            thread.join()
+        if self._submitter is not None:
+            self._submitter.join()
@@ -0,0 +1,43 @@
+import hashlib
+import time
+
+from sawtooth_sdk.protobuf.batch_pb2 import Batch
+from sawtooth_sdk.protobuf.batch_pb2 import BatchHeader
+from sawtooth_sdk.protobuf.transaction_pb2 import Transaction
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader
+
+FAMILY_NAME = 'barcode'
+FAMILY_VERSION = '1.0'
+
+
+def make_payload(name, action, location=''):
+    # Serialization is just a delimited utf-8 encoded string
+    return ",".join([name, action, location]).encode()
+
+
+def make_transaction(signer, payload, inputs, outputs, dependencies=None, family_name=FAMILY_NAME):
+    # the processor takes the time of a create or update hop from the nonce, it must stay time.time().hex()
+    public_key = signer.get_public_key().as_hex()
+    header = TransactionHeader(signer_public_key=public_key, family_name=family_name,
+                               family_version=FAMILY_VERSION, inputs=inputs, outputs=outputs,
+                               dependencies=dependencies or [], payload_sha512=hashlib.sha512(payload).hexdigest(),
+                               batcher_public_key=public_key,
+                               nonce=time.time().hex().encode()).SerializeToString()
+    signature = signer.sign(header)
+    return Transaction(header=header, payload=payload, header_signature=signature)
+
+
+def make_batch(signer, transactions):
+    transaction_signatures = [t.header_signature for t in transactions]
+
+    header = BatchHeader(
+        signer_public_key=signer.get_public_key().as_hex(),
+        transaction_ids=transaction_signatures
+    ).SerializeToString()
+
+    signature = signer.sign(header)
+
+    return Batch(
+        header=header,
+        transactions=transactions,
+        header_signature=signature)
@@ -48,11 +48,13 @@ setup(
         'psycopg2-binary',
         'docopt',
         'pygame',
+        'pyzmq',
     ],
     data_files=data_files,
     entry_points={
         'console_scripts': [
             'barcode_cli = sawtooth_barcode.barcode_cli:main',
             'barcode_tp = sawtooth_barcode.processor.main:main',
+            'barcode_gateway = sawtooth_barcode.gateway:main',
         ]
     })
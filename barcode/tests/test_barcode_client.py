@@ -0,0 +1,81 @@
+import base64
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('sawtooth_sdk')
+pytest.importorskip('sawtooth_signing')
+pytest.importorskip('zbar')
+
+from sawtooth_sdk.protobuf.batch_pb2 import Batch  # noqa: E402
+
+from sawtooth_barcode.barcode_cli import BarcodeClient  # noqa: E402
+from sawtooth_barcode.spool import BatchSpool  # noqa: E402
+from sawtooth_barcode.state_cache import ClientStateCache  # noqa: E402
+
+
+def _batch(name):
+    return Batch(header_signature='batch-' + name)
+
+
+class _Response(object):
+
+    def __init__(self, status_code, reason, text=''):
+        self.status_code = status_code
+        self.reason = reason
+        self.ok = status_code < 400
+        self.text = text
+
+
+class TestRestApiErrors(unittest.TestCase):
+    """Drains through a real BarcodeClient, only requests.post is replaced."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.spool = BatchSpool(os.path.join(self.tmp_dir, 'spool.db'))
+        self.client = BarcodeClient('http://127.0.0.1:8008')
+        for name in 'abc':
+            self.spool.append('barcode', _batch(name), {'1': 'txn-' + name})
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_unavailable_validator_keeps_batches_queued(self):
+        with mock.patch('requests.post', return_value=_Response(503, 'Service Unavailable')):
+            with self.assertRaises(Exception):
+                self.spool.drain(self.client)
+        status = self.spool.status()
+        self.assertEqual((status['queued'], status['invalid']), (3, 0))
+        self.assertEqual(self.spool.last_transaction('barcode', '1'), 'txn-c')
+
+    def test_bad_request_invalidates_batches(self):
+        with mock.patch('requests.post', return_value=_Response(400, 'Bad Request')):
+            self.assertEqual(self.spool.drain(self.client), (0, 0))
+        status = self.spool.status()
+        self.assertEqual((status['queued'], status['invalid']), (0, 3))
+
+
+class TestStateReads(unittest.TestCase):
+
+    def setUp(self):
+        self.urls = []
+        self.client = BarcodeClient('http://127.0.0.1:8008', state_cache=ClientStateCache(head_ttl=60))
+
+    def _get(self, url, headers=None):
+        self.urls.append(url.split('/', 3)[3])
+        data = base64.b64encode(b'4006381333931,Widget,2018-01-01,Factory').decode()
+        return _Response(200, 'OK', json.dumps({'data': data, 'head': 'head1'}))
+
+    def test_head_is_learned_from_the_first_read(self):
+        with mock.patch('requests.get', side_effect=self._get):
+            self.client.show('4006381333931')
+            self.client.show('4006381333931')
+            self.client.show('123')
+        first, second = self.client._get_address('4006381333931'), self.client._get_address('123')
+        self.assertEqual(self.urls, ['state/' + first, 'state/{}?head=head1'.format(second)])
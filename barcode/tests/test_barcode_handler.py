@@ -0,0 +1,287 @@
+import time
+import unittest
+
+import pytest
+
+pytest.importorskip('sawtooth_sdk')
+pytest.importorskip('sawtooth_signing')
+pytest.importorskip('psycopg2')
+
+from sawtooth_sdk.processor.exceptions import InvalidTransaction  # noqa: E402
+from sawtooth_signing import create_context  # noqa: E402
+
+from sawtooth_barcode.addressing import make_head_address  # noqa: E402
+from sawtooth_barcode.addressing import make_role_address  # noqa: E402
+from sawtooth_barcode.addressing import make_role_registry_address  # noqa: E402
+from sawtooth_barcode.addressing import tenant_prefix  # noqa: E402
+from sawtooth_barcode.barcode_codec import parse_state_data  # noqa: E402
+from sawtooth_barcode.barcode_codec import serialize_state_data  # noqa: E402
+from sawtooth_barcode.barcode_codec import split_hops  # noqa: E402
+from sawtooth_barcode.processor.barcode_handler import BarcodeTransactionHandler  # noqa: E402
+from sawtooth_barcode.processor.barcode_handler import _make_xo_address  # noqa: E402
+from sawtooth_barcode.processor.roles import RoleCache  # noqa: E402
+from sawtooth_barcode.processor.roles import serialize_role  # noqa: E402
+from sawtooth_barcode.provenance import GENESIS_DIGEST  # noqa: E402
+from sawtooth_barcode.provenance import hop_digest  # noqa: E402
+from sawtooth_barcode.provenance import parse_head  # noqa: E402
+
+PREFIX = tenant_prefix(None)
+BARCODE = '4006381333931'
+SUPPLIER = '02' + 'ab' * 32
+
+
+class _Entry(object):
+
+    def __init__(self, address, data):
+        self.address = address
+        self.data = data
+
+
+class _Header(object):
+
+    def __init__(self, signer, nonce):
+        self.signer_public_key = signer
+        self.nonce = nonce
+
+
+class _Transaction(object):
+
+    def __init__(self, signer, b_id, action, location='', timestamp=None):
+        self.header = _Header(signer, (timestamp if timestamp is not None else time.time()).hex())
+        self.payload = ','.join([b_id, action, location]).encode()
+
+
+class _Context(object):
+    """In-memory context that keeps every get_state call for inspection."""
+
+    def __init__(self, state=None):
+        self.state = dict(state or {})
+        self.reads = []
+        self.events = []
+
+    def get_state(self, addresses, timeout=None):
+        self.reads.append(list(addresses))
+        return [_Entry(address, self.state[address]) for address in addresses if address in self.state]
+
+    def set_state(self, entries, timeout=None):
+        self.state.update(entries)
+        return list(entries)
+
+    def add_event(self, event_type, attributes=None, data=None, timeout=None):
+        self.events.append((event_type, dict(attributes or [])))
+
+
+def _role(public_key, role, name):
+    return {make_role_address(PREFIX, public_key): serialize_role(public_key, role, name)}
+
+
+def _item(location):
+    return {_make_xo_address(PREFIX, BARCODE): serialize_state_data({BARCODE: ('Widget', '2018-01-01', location)})}
+
+
+class TestRoleReads(unittest.TestCase):
+
+    def setUp(self):
+        self.role_cache = RoleCache()
+        self.handler = BarcodeTransactionHandler(role_cache=self.role_cache, barcode_details=lambda b_id: {})
+
+    def test_role_is_read_with_the_item_in_one_call(self):
+        context = _Context(dict(_role(SUPPLIER, 'supplier', 'bob'), **_item('Factory')))
+        self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot'), context)
+        self.assertEqual(len(context.reads), 1)
+        self.assertEqual(set(context.reads[0]), {_make_xo_address(PREFIX, BARCODE),
+                                                 make_role_address(PREFIX, SUPPLIER),
+                                                 make_head_address(PREFIX, BARCODE)})
+
+    def test_revoked_role_is_not_served_from_the_cache(self):
+        state = dict(_role(SUPPLIER, 'supplier', 'bob'), **_item('Factory'))
+        self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot'), _Context(state))
+        # the same cache, but a context in which the signer has no role
+        state.pop(make_role_address(PREFIX, SUPPLIER))
+        with self.assertRaises(InvalidTransaction):
+            self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Port'), _Context(state))
+
+    def test_changed_role_is_honoured(self):
+        handler = BarcodeTransactionHandler(role_cache=self.role_cache,
+                                            barcode_details=lambda b_id: {b_id: ('Widget', '2018-01-01', 'Factory')})
+        state = _role(SUPPLIER, 'admin', 'bob')
+        handler.apply(_Transaction(SUPPLIER, BARCODE, 'create'), _Context(state))
+        state.update(_role(SUPPLIER, 'supplier', 'bob'))
+        with self.assertRaises(InvalidTransaction):
+            handler.apply(_Transaction(SUPPLIER, BARCODE, 'create'), _Context(state))
+
+    def test_handlers_sharing_a_cache_agree_with_state(self):
+        other = BarcodeTransactionHandler(role_cache=self.role_cache, barcode_details=lambda b_id: {})
+        state = dict(_role(SUPPLIER, 'supplier', 'bob'), **_item('Factory'))
+        self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot'), _Context(state))
+        other.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot'), _Context(state))
+        with self.assertRaises(InvalidTransaction):
+            other.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot'), _Context(_item('Factory')))
+
+
+class TestApply(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = BarcodeTransactionHandler(barcode_details=lambda b_id: {})
+        self.context = _Context(dict(_role(SUPPLIER, 'supplier', 'bob'), **_item('Factory')))
+
+    def test_update_appends_the_location_and_its_time(self):
+        self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot', timestamp=1500000000.5), self.context)
+        product_name, mfg_date, location = parse_state_data(
+            self.context.state[_make_xo_address(PREFIX, BARCODE)])[BARCODE]
+        self.assertEqual((product_name, mfg_date), ('Widget', '2018-01-01'))
+        self.assertEqual(split_hops(location), [('Factory', None), ('Depot', 1500000000.5)])
+
+    def test_move_stores_every_hop_time(self):
+        self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'move', 'Depot@1500000000.0;Port@1500000060.0'),
+                           self.context)
+        location = parse_state_data(self.context.state[_make_xo_address(PREFIX, BARCODE)])[BARCODE][2]
+        self.assertEqual(split_hops(location),
+                         [('Factory', None), ('Depot', 1500000000.0), ('Port', 1500000060.0)])
+
+    def test_reserved_characters_in_a_location_are_rejected(self):
+        with self.assertRaises(InvalidTransaction):
+            self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot@1'), self.context)
+
+    def test_reserved_characters_in_a_move_hop_are_rejected(self):
+        for hops in ('Depot|x@1.0;Port@2.0', 'Depot-> x@1.0', 'Depot@1.0;@2.0'):
+            with self.assertRaises(InvalidTransaction):
+                self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'move', hops), self.context)
+        address = _make_xo_address(PREFIX, BARCODE)
+        self.assertEqual(self.context.state[address], _item('Factory')[address])
+
+    def test_move_hop_times_must_be_finite(self):
+        for hops in ('Depot@nan', 'Depot@1.0;Port@inf'):
+            with self.assertRaises(InvalidTransaction):
+                self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'move', hops), self.context)
+
+    def test_update_advances_the_provenance_head(self):
+        self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot'), self.context)
+        self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Port'), self.context)
+        _, count = parse_head(self.context.state[make_head_address(PREFIX, BARCODE)])
+        self.assertEqual(count, 2)
+        self.assertEqual([attributes['location'] for _, attributes in self.context.events], ['Depot', 'Port'])
+
+    def test_events_name_the_tenant(self):
+        self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot'), self.context)
+        acme = BarcodeTransactionHandler(tenant='acme', barcode_details=lambda b_id: {})
+        acme_prefix = tenant_prefix('acme')
+        context = _Context({make_role_address(acme_prefix, SUPPLIER): serialize_role(SUPPLIER, 'supplier', 'bob'),
+                            _make_xo_address(acme_prefix, BARCODE):
+                                serialize_state_data({BARCODE: ('Widget', '2018-01-01', 'Factory')})})
+        acme.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot'), context)
+        self.assertEqual(self.context.events[0][1]['tenant'], 'default')
+        self.assertEqual(context.events[0][1]['tenant'], 'acme')
+
+    def test_create_starts_the_provenance_chain(self):
+        admin = '02' + 'ef' * 32
+        handler = BarcodeTransactionHandler(
+            barcode_details=lambda b_id: {b_id: ('Widget', '2018-01-01', 'Factory')})
+        context = _Context(_role(admin, 'admin', 'alice'))
+        handler.apply(_Transaction(admin, BARCODE, 'create', timestamp=1500000000.0), context)
+        digest, count = parse_head(context.state[make_head_address(PREFIX, BARCODE)])
+        self.assertEqual(count, 1)
+        self.assertEqual(digest, hop_digest(GENESIS_DIGEST, 'Factory', admin, 1500000000.0))
+
+    def test_existing_item_can_not_be_created_again(self):
+        admin = '02' + 'ef' * 32
+        handler = BarcodeTransactionHandler(
+            barcode_details=lambda b_id: {b_id: ('Widget', '2018-01-01', 'Factory')})
+        self.context.state.update(_role(admin, 'admin', 'alice'))
+        self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'update', 'Depot'), self.context)
+        state = dict(self.context.state)
+        with self.assertRaises(InvalidTransaction):
+            handler.apply(_Transaction(admin, BARCODE, 'create'), self.context)
+        self.assertEqual(self.context.state, state)
+
+    def test_item_missing_from_the_catalog_can_not_be_created(self):
+        admin = '02' + 'ef' * 32
+        context = _Context(_role(admin, 'admin', 'alice'))
+        with self.assertRaises(InvalidTransaction):
+            self.handler.apply(_Transaction(admin, BARCODE, 'create'), context)
+        self.assertNotIn(make_head_address(PREFIX, BARCODE), context.state)
+
+    def test_hops_of_an_unknown_item_are_rejected(self):
+        context = _Context(_role(SUPPLIER, 'supplier', 'bob'))
+        for action, location in (('update', 'Depot'), ('move', 'Depot@1.0')):
+            with self.assertRaises(InvalidTransaction):
+                self.handler.apply(_Transaction(SUPPLIER, '999', action, location), context)
+        self.assertEqual((set(context.state), context.events), (set(_role(SUPPLIER, 'supplier', 'bob')), []))
+
+    def test_nonce_must_be_a_time(self):
+        transaction = _Transaction(SUPPLIER, BARCODE, 'update', 'Depot')
+        transaction.header.nonce = 'not a time'
+        with self.assertRaises(InvalidTransaction):
+            self.handler.apply(transaction, self.context)
+
+    def test_unregistered_signer_is_rejected(self):
+        with self.assertRaises(InvalidTransaction):
+            self.handler.apply(_Transaction('03' + 'cd' * 32, BARCODE, 'update', 'Depot'), self.context)
+
+    def test_supplier_can_not_create(self):
+        with self.assertRaises(InvalidTransaction):
+            self.handler.apply(_Transaction(SUPPLIER, BARCODE, 'create'), self.context)
+
+
+class TestAddUser(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = BarcodeTransactionHandler(barcode_details=lambda b_id: {})
+        self.signing = create_context('secp256k1')
+
+    def _key(self):
+        private_key = self.signing.new_random_private_key()
+        return private_key.as_hex(), self.signing.get_public_key(private_key).as_hex()
+
+    def test_first_admin_registers_itself(self):
+        private_key, public_key = self._key()
+        context = _Context()
+        self.handler.apply(_Transaction(public_key, 'admin', 'add', 'admin:' + private_key), context)
+        self.assertIn(make_role_address(PREFIX, public_key), context.state)
+        self.assertIn(make_role_registry_address(PREFIX), context.state)
+
+    def test_second_self_registration_is_rejected(self):
+        context = _Context()
+        private_key, public_key = self._key()
+        self.handler.apply(_Transaction(public_key, 'admin', 'add', 'admin:' + private_key), context)
+        private_key, public_key = self._key()
+        with self.assertRaises(InvalidTransaction):
+            self.handler.apply(_Transaction(public_key, 'mallory', 'add', 'admin:' + private_key), context)
+
+    def test_admin_adds_a_supplier(self):
+        context = _Context()
+        admin_private, admin_public = self._key()
+        self.handler.apply(_Transaction(admin_public, 'admin', 'add', 'admin:' + admin_private), context)
+        private_key, public_key = self._key()
+        self.handler.apply(_Transaction(admin_public, 'bob', 'add', 'supplier:' + private_key), context)
+        self.assertEqual(context.state[make_role_address(PREFIX, public_key)],
+                         serialize_role(public_key, 'supplier', 'bob'))
+
+    def _legacy_user(self, context, name, tag):
+        # how processors before role records stored a user
+        private_key, public_key = self._key()
+        context.state[_make_xo_address(PREFIX, name)] = '|'.join([name, tag, private_key]).encode()
+        return private_key, public_key
+
+    def test_user_registered_before_roles_migrates_itself(self):
+        context = _Context()
+        self._legacy_user(context, 'admin', 'admin')
+        private_key, public_key = self._legacy_user(context, 'bob', 'supplier')
+        self.handler.apply(_Transaction(public_key, 'bob', 'add', 'supplier:' + private_key), context)
+        self.assertEqual(context.state[make_role_address(PREFIX, public_key)],
+                         serialize_role(public_key, 'supplier', 'bob'))
+
+    def test_migration_keeps_the_recorded_role(self):
+        context = _Context()
+        self._legacy_user(context, 'admin', 'admin')
+        private_key, public_key = self._legacy_user(context, 'bob', 'supplier')
+        with self.assertRaises(InvalidTransaction):
+            self.handler.apply(_Transaction(public_key, 'bob', 'add', 'admin:' + private_key), context)
+
+    def test_upgraded_chain_can_not_be_bootstrapped(self):
+        context = _Context()
+        self._legacy_user(context, 'admin', 'admin')
+        private_key, public_key = self._key()
+        with self.assertRaises(InvalidTransaction):
+            self.handler.apply(_Transaction(public_key, 'mallory', 'add', 'admin:' + private_key), context)
+        self.assertNotIn(make_role_address(PREFIX, public_key), context.state)
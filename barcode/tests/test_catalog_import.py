@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import pytest
+
+pytest.importorskip('sawtooth_sdk')
+pytest.importorskip('psycopg2')
+
+import yaml  # noqa: E402
+from sawtooth_sdk.protobuf.batch_pb2 import Batch  # noqa: E402
+from sawtooth_sdk.protobuf.transaction_pb2 import Transaction  # noqa: E402
+
+from sawtooth_barcode.catalog_import import CatalogImporter  # noqa: E402
+from sawtooth_barcode.rate_control import QueueFullError  # noqa: E402
+
+
+class _Client(object):
+    """Accepts every BatchList except those holding a barcode in `refused`; sent batches are COMMITTED."""
+
+    _family_name = 'barcode'
+
+    def __init__(self):
+        self.refused = set()
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def _create_transaction(self, b_id, action):
+        return Transaction(header_signature='txn-' + b_id, payload='{},{},'.format(b_id, action).encode())
+
+    def _create_batch(self, transactions):
+        return Batch(transactions=transactions, header_signature='batch-' + transactions[0].header_signature)
+
+    def send_batch_list(self, batch_list):
+        b_ids = [txn.payload.decode().split(',')[0] for batch in batch_list.batches for txn in batch.transactions]
+        if self.refused.intersection(b_ids):
+            raise QueueFullError('Validator queue full')
+        with self._lock:
+            self.sent.extend(b_ids)
+
+    def get_batch_statuses(self, batch_ids, wait):
+        sent = set('batch-txn-' + b_id for b_id in self.sent)
+        return {batch_id: 'COMMITTED' if batch_id in sent else 'UNKNOWN' for batch_id in batch_ids}
+
+
+class _Importer(CatalogImporter):
+
+    catalog = [str(b_id) for b_id in range(100, 130)]
+
+    def _rows(self, last_barcode_id):
+        rows = [b_id for b_id in self.catalog if last_barcode_id is None or b_id > last_barcode_id]
+        for i in range(0, len(rows), self._chunk_size):
+            yield rows[i:i + self._chunk_size]
+
+
+class TestCatalogImporter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.checkpoint = os.path.join(self.tmp_dir, 'import.checkpoint')
+        self.client = _Client()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _importer(self):
+        return _Importer(self.client, checkpoint_path=self.checkpoint, chunk_size=5, batch_size=5, max_in_flight=3)
+
+    def test_imports_every_row(self):
+        self.assertEqual(self._importer().run(), (30, 0))
+        self.assertEqual(sorted(self.client.sent), _Importer.catalog)
+
+    def test_failed_chunk_does_not_cause_resubmissions(self):
+        self.client.refused.add('110')
+        with self.assertRaises(QueueFullError):
+            self._importer().run()
+        with open(self.checkpoint) as fd:
+            checkpoint = yaml.safe_load(fd)
+        # the chunks in flight are looked up by the next run, not read from the catalog again
+        self.assertIn('batch-txn-110', checkpoint['unsettled'])
+        sent_before = list(self.client.sent)
+
+        self.client.refused.clear()
+        self.assertEqual(self._importer().run(), (30, 0))
+        self.assertEqual(sorted(self.client.sent), _Importer.catalog)
+        self.assertEqual(len(self.client.sent), 30)
+        self.assertEqual(self.client.sent[:len(sent_before)], sent_before)
@@ -0,0 +1,106 @@
+import unittest
+
+import pytest
+
+pytest.importorskip('sawtooth_sdk')
+
+from sawtooth_sdk.protobuf.batch_pb2 import Batch  # noqa: E402
+from sawtooth_sdk.protobuf.transaction_pb2 import Transaction  # noqa: E402
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader  # noqa: E402
+
+from sawtooth_barcode.barcode_codec import decode_hops  # noqa: E402
+from sawtooth_barcode.barcode_codec import encode_hops  # noqa: E402
+from sawtooth_barcode.coalescer import HopCoalescer  # noqa: E402
+from sawtooth_barcode.txn_builder import make_payload  # noqa: E402
+
+
+class _Client(object):
+    """Builds unsigned protobufs; send_batch_list fails while `down` is set, statuses default to PENDING."""
+
+    def __init__(self):
+        self.down = False
+        self.sent = []
+        self.overlays = []
+        self.statuses = {}
+        self._count = 0
+
+    def _create_move_transaction(self, b_id, hops, dependencies=None):
+        self._count += 1
+        header = TransactionHeader(family_name='barcode', dependencies=dependencies or [])
+        return Transaction(header=header.SerializeToString(), header_signature='txn{}'.format(self._count),
+                           payload=make_payload(b_id, 'move', encode_hops(hops)))
+
+    def _create_batch(self, transactions):
+        return Batch(transactions=transactions, header_signature='batch-' + transactions[0].header_signature)
+
+    def send_batch_list(self, batch_list):
+        if self.down:
+            raise Exception('validator down')
+        self.sent.append(list(batch_list.batches))
+
+    def get_batch_statuses(self, batch_ids, wait):
+        return {batch_id: self.statuses.get(batch_id, 'PENDING') for batch_id in batch_ids}
+
+    def _overlay_hops(self, b_id, hops, batch_id):
+        self.overlays.append((b_id, batch_id))
+
+
+def _transaction(batch):
+    """(barcode, action, hops, dependencies) of the batch's only transaction."""
+    transaction, = batch.transactions
+    b_id, action, location = transaction.payload.decode().split(',')
+    dependencies = list(TransactionHeader.FromString(transaction.header).dependencies)
+    return b_id, action, decode_hops(location), dependencies
+
+
+class TestHopCoalescer(unittest.TestCase):
+
+    def setUp(self):
+        self.client = _Client()
+        self.coalescer = HopCoalescer(self.client, window=60)
+
+    def test_hops_of_one_barcode_become_one_transaction(self):
+        self.coalescer.add('1', 'Depot', 1.0)
+        self.coalescer.add('1', 'Port', 2.0)
+        self.coalescer.add('2', 'Depot', 3.0)
+        self.coalescer.flush()
+        batches, = self.client.sent
+        self.assertEqual([_transaction(batch)[:3] for batch in batches],
+                         [('1', 'move', [('Depot', 1.0), ('Port', 2.0)]), ('2', 'move', [('Depot', 3.0)])])
+        self.assertEqual(self.coalescer.submitted_hops, 3)
+
+    def test_a_single_hop_keeps_its_scan_time(self):
+        self.coalescer.add('1', 'Depot', 1500000000.25)
+        self.coalescer.flush()
+        batch, = self.client.sent[0]
+        self.assertEqual(_transaction(batch)[1:3], ('move', [('Depot', 1500000000.25)]))
+
+    def test_failed_send_keeps_the_hops_and_no_dependency(self):
+        self.coalescer.add('1', 'Depot', 1.0)
+        self.client.down = True
+        with self.assertRaises(Exception):
+            self.coalescer.flush()
+        self.coalescer.add('1', 'Port', 2.0)
+        self.client.down = False
+        self.coalescer.flush()
+        batch, = self.client.sent[0]
+        _, _, hops, dependencies = _transaction(batch)
+        self.assertEqual(hops, [('Depot', 1.0), ('Port', 2.0)])
+        self.assertEqual(dependencies, [])
+
+    def test_next_flush_depends_on_the_submitted_transaction(self):
+        self.coalescer.add('1', 'Depot', 1.0)
+        self.coalescer.flush()
+        self.coalescer.add('1', 'Port', 2.0)
+        self.coalescer.flush()
+        (first,), (second,) = self.client.sent
+        self.assertEqual(_transaction(second)[3], [first.transactions[0].header_signature])
+
+    def test_rejected_or_lost_transaction_is_no_longer_depended_on(self):
+        for status in ('INVALID', 'UNKNOWN', 'COMMITTED'):
+            self.coalescer.add('1', 'Depot', 1.0)
+            self.coalescer.flush()
+            self.client.statuses[self.client.sent[-1][0].header_signature] = status
+            self.coalescer.add('1', 'Port', 2.0)
+            self.coalescer.flush()
+            self.assertEqual(_transaction(self.client.sent[-1][0])[3], [])
@@ -0,0 +1,66 @@
+import json
+import os
+import shelve
+import shutil
+import tempfile
+import unittest
+
+from sawtooth_barcode.history import BlockIndex
+from sawtooth_barcode.history import _block_timestamp
+
+
+def _block(*headers, block_num=0):
+    return {'header': {'block_num': str(block_num)}, 'header_signature': 'block{}'.format(block_num),
+            'batches': [{'transactions': [{'header': header} for header in headers]}]}
+
+
+class _Client(object):
+    """Serves `blocks` newest first as a single page."""
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+
+    def _send_request(self, suffix):
+        return json.dumps({'data': list(reversed(self.blocks))})
+
+
+class TestBlockTimestamp(unittest.TestCase):
+
+    def test_latest_barcode_nonce_times_the_block(self):
+        block = _block({'family_name': 'barcode', 'nonce': (1500000000.0).hex()},
+                       {'family_name': 'barcode-acme', 'nonce': (1500000060.0).hex()})
+        self.assertEqual(_block_timestamp(block), 1500000060.0)
+
+    def test_other_families_are_ignored(self):
+        block = _block({'family_name': 'barcode', 'nonce': (1500000000.0).hex()},
+                       {'family_name': 'intkey', 'nonce': hex(2 ** 63)})
+        self.assertEqual(_block_timestamp(block), 1500000000.0)
+
+    def test_block_without_barcode_transactions_has_no_time(self):
+        self.assertIsNone(_block_timestamp(_block({'family_name': 'sawtooth_settings', 'nonce': '0x1p+30'})))
+
+
+class TestBlockIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'index')
+        self.client = _Client([
+            _block({'family_name': 'barcode', 'nonce': (1500000000.0).hex()}, block_num=0),
+            _block({'family_name': 'intkey', 'nonce': hex(2 ** 63)}, block_num=1),
+            _block({'family_name': 'barcode', 'nonce': (1500000120.0).hex()}, block_num=2),
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_block_at_time_skips_foreign_nonces(self):
+        self.assertEqual(BlockIndex(self.client, path=self.path).block_at_time(1500000060.0), 'block1')
+
+    def test_index_of_an_older_format_is_rebuilt(self):
+        with shelve.open(self.path) as index:
+            index['indexed_range'] = (2, 0)
+            index['0'] = ('block0', 1500000000.0)
+            index['1'] = ('block1', float(2 ** 63))
+            index['2'] = ('block2', 1500000120.0)
+        self.assertEqual(BlockIndex(self.client, path=self.path).block_at_time(1500000060.0), 'block1')
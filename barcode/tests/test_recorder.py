@@ -0,0 +1,64 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytest
+
+pytest.importorskip('sawtooth_sdk')
+
+from sawtooth_sdk.protobuf.transaction_pb2 import TransactionHeader  # noqa: E402
+
+from sawtooth_barcode.processor.recorder import _b64  # noqa: E402
+from sawtooth_barcode.processor.recorder import read_log  # noqa: E402
+
+
+def _entry(index):
+    header = TransactionHeader(signer_public_key='02' + 'ab' * 32, nonce=float(index).hex())
+    return {
+        'header': _b64(header.SerializeToString()),
+        'signature': '{:0128x}'.format(index),
+        'payload': _b64('4006381333931,update,Depot{}'.format(index).encode()),
+        'reads': {},
+        'writes': {},
+        'db': {},
+        'outcome': 'ok',
+    }
+
+
+class TestReadLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'apply.log.gz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, entries):
+        # one gzip member per processor run, as TransactionRecorder appends them
+        with gzip.open(self.path, 'at') as fd:
+            for entry in entries:
+                fd.write(json.dumps(entry) + '\n')
+
+    def test_reads_every_appended_run(self):
+        self._write([_entry(i) for i in range(3)])
+        self._write([_entry(i) for i in range(3, 5)])
+        self.assertEqual([entry['signature'] for entry in read_log(self.path)],
+                         [_entry(i)['signature'] for i in range(5)])
+
+    def test_truncated_tail_ends_the_log(self):
+        self._write([_entry(i) for i in range(3)])
+        self._write([_entry(i) for i in range(3, 500)])
+        with open(self.path, 'rb') as fd:
+            data = fd.read()
+        # a crash before the last member was finished
+        with open(self.path, 'wb') as fd:
+            fd.write(data[:-200])
+        entries = list(read_log(self.path))
+        self.assertGreaterEqual(len(entries), 3)
+        self.assertLess(len(entries), 500)
+        self.assertEqual([entry['signature'] for entry in entries],
+                         [_entry(i)['signature'] for i in range(len(entries))])
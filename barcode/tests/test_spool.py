@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import pytest
+
+pytest.importorskip('sawtooth_sdk')
+
+from sawtooth_sdk.protobuf.batch_pb2 import Batch  # noqa: E402
+
+from sawtooth_barcode.spool import BatchRefusedError  # noqa: E402
+from sawtooth_barcode.spool import BatchSpool  # noqa: E402
+from sawtooth_barcode.spool import ConnectionFailedError  # noqa: E402
+
+
+def _batch(name):
+    return Batch(header_signature='batch-' + name)
+
+
+class _Client(object):
+    """REST API stand-in: refuses BatchLists holding a batch in `refused`, reports `statuses`."""
+
+    def __init__(self):
+        self.refused = set()
+        self.statuses = {}
+        self.down = False
+        self.unavailable = False
+        self.sent = []
+
+    def send_batch_list(self, batch_list):
+        if self.down:
+            raise ConnectionFailedError('no route to host')
+        if self.unavailable:
+            raise Exception('Error 503: Service Unavailable')
+        batch_ids = [batch.header_signature for batch in batch_list.batches]
+        if self.refused.intersection(batch_ids):
+            raise BatchRefusedError('Error 400: Bad Request')
+        self.sent.extend(batch_ids)
+
+    def get_batch_statuses(self, batch_ids, wait):
+        return {batch_id: self.statuses.get(batch_id, 'PENDING') for batch_id in batch_ids}
+
+
+class TestBatchSpool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.spool = BatchSpool(os.path.join(self.tmp_dir, 'spool.db'))
+        self.client = _Client()
+
+    def tearDown(self):
+        self.spool.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _states(self):
+        return dict(self.spool._db.execute('SELECT batch_id, state FROM batches').fetchall())
+
+    def test_heads_are_kept_per_family(self):
+        self.spool.append('barcode', _batch('a'), {'1': 'txn-a'})
+        self.spool.append('barcode-acme', _batch('b'), {'1': 'txn-b'})
+        self.assertEqual(self.spool.last_transaction('barcode', '1'), 'txn-a')
+        self.assertEqual(self.spool.last_transaction('barcode-acme', '1'), 'txn-b')
+
+    def test_committed_batches_are_removed(self):
+        self.spool.append('barcode', _batch('a'), {'1': 'txn-a'})
+        self.client.statuses['batch-a'] = 'COMMITTED'
+        self.assertEqual(self.spool.drain(self.client), (1, 1))
+        self.assertEqual(self._states(), {})
+        self.assertIsNone(self.spool.last_transaction('barcode', '1'))
+
+    def test_rejected_batch_takes_its_dependents_along(self):
+        self.spool.append('barcode', _batch('a'), {'1': 'txn-a'})
+        self.spool.append('barcode', _batch('b'), {'1': 'txn-b'})
+        self.spool.append('barcode', _batch('c'), {'1': 'txn-c'})
+        self.spool.append('barcode', _batch('d'), {'2': 'txn-d'})
+        self.spool.drain(self.client)
+        self.client.statuses.update({'batch-a': 'INVALID', 'batch-d': 'COMMITTED'})
+        self.spool.drain(self.client)
+        self.assertEqual(self._states(), {'batch-a': 'invalid', 'batch-b': 'invalid', 'batch-c': 'invalid'})
+        self.assertIsNone(self.spool.last_transaction('barcode', '1'))
+
+    def test_refused_batch_does_not_block_the_others(self):
+        for name in 'abc':
+            self.spool.append('barcode', _batch(name), {name: 'txn-' + name})
+        self.client.refused.add('batch-b')
+        submitted, _ = self.spool.drain(self.client)
+        self.assertEqual(submitted, 2)
+        self.assertEqual(self.client.sent, ['batch-a', 'batch-c'])
+        self.assertEqual(self._states(), {'batch-a': 'submitted', 'batch-b': 'invalid', 'batch-c': 'submitted'})
+
+    def test_refused_batch_is_not_followed_by_its_dependents(self):
+        self.spool.append('barcode', _batch('a'), {'1': 'txn-a'})
+        self.spool.append('barcode', _batch('b'), {'1': 'txn-b'})
+        self.client.refused.add('batch-a')
+        self.spool.drain(self.client)
+        self.assertEqual(self.client.sent, [])
+        self.assertEqual(self._states(), {'batch-a': 'invalid', 'batch-b': 'invalid'})
+
+    def test_unreachable_api_keeps_batches_queued(self):
+        self.spool.append('barcode', _batch('a'), {'1': 'txn-a'})
+        self.client.down = True
+        with self.assertRaises(ConnectionFailedError):
+            self.spool.drain(self.client)
+        self.assertEqual(self._states(), {'batch-a': 'queued'})
+
+    def test_unavailable_validator_keeps_batches_queued(self):
+        self.spool.append('barcode', _batch('a'), {'1': 'txn-a'})
+        self.spool.append('barcode', _batch('b'), {'1': 'txn-b'})
+        self.client.unavailable = True
+        with self.assertRaises(Exception):
+            self.spool.drain(self.client)
+        self.assertEqual(self._states(), {'batch-a': 'queued', 'batch-b': 'queued'})
+        self.assertEqual(self.spool.last_transaction('barcode', '1'), 'txn-b')
+        self.client.unavailable = False
+        self.assertEqual(self.spool.drain(self.client), (2, 0))
@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import pytest
+
+pygame = pytest.importorskip('pygame')
+pytest.importorskip('zbar')
+
+from sawtooth_barcode.station import DedupQueue  # noqa: E402
+from sawtooth_barcode.station import FileSource  # noqa: E402
+from sawtooth_barcode.station import ScanStation  # noqa: E402
+
+
+class _ListSource(object):
+    """Source whose frames are the barcodes a _EchoReader reports for them."""
+
+    def __init__(self, name, frames):
+        self.name = name
+        self._frames = frames
+        self.opened = False
+        self.closed = False
+
+    def open(self):
+        self.opened = True
+
+    def close(self):
+        self.closed = True
+
+    def frames(self, stop_event):
+        for frame in self._frames:
+            if stop_event.is_set():
+                return
+            yield frame
+
+
+class _EchoReader(object):
+
+    def __init__(self, cam_name):
+        self.cam_name = cam_name
+
+    def decode(self, frame):
+        return list(frame)
+
+
+class TestFileSource(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = []
+        for i, size in enumerate([(8, 6), (4, 3)]):
+            path = os.path.join(self.tmp_dir, 'frame{}.png'.format(i))
+            pygame.image.save(pygame.Surface(size), path)
+            self.paths.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_replays_every_file_once(self):
+        frames = list(FileSource(self.paths).frames(threading.Event()))
+        self.assertEqual([frame.shape[:2] for frame in frames], [(8, 6), (4, 3)])
+
+    def test_loops_until_stopped(self):
+        stop_event = threading.Event()
+        frames = []
+        for frame in FileSource(self.paths, loop=True).frames(stop_event):
+            frames.append(frame)
+            if len(frames) == 5:
+                stop_event.set()
+        self.assertEqual(len(frames), 5)
+
+    def test_name_lists_the_files(self):
+        self.assertEqual(FileSource(self.paths).name, 'file:' + ','.join(self.paths))
+
+
+class TestDedupQueue(unittest.TestCase):
+
+    def test_drops_repeats_within_ttl(self):
+        dedup = DedupQueue(ttl=60)
+        self.assertTrue(dedup.put('123'))
+        self.assertFalse(dedup.put('123'))
+        self.assertTrue(dedup.put('456'))
+        self.assertEqual(dedup.duplicates, 1)
+        self.assertEqual([dedup.get(timeout=1), dedup.get(timeout=1)], ['123', '456'])
+        self.assertTrue(dedup.empty())
+
+    def test_accepts_repeats_after_ttl(self):
+        dedup = DedupQueue(ttl=0.05)
+        self.assertTrue(dedup.put('123'))
+        time.sleep(0.1)
+        self.assertTrue(dedup.put('123'))
+        self.assertEqual(dedup.duplicates, 0)
+
+    def test_requeue_bypasses_the_repeat_check(self):
+        dedup = DedupQueue(ttl=60)
+        dedup.put('123')
+        dedup.get(timeout=1)
+        dedup.requeue(['123'])
+        self.assertEqual(dedup.get(timeout=1), '123')
+        self.assertEqual(dedup.duplicates, 0)
+
+    def test_forget_lets_a_rescan_through(self):
+        dedup = DedupQueue(ttl=60)
+        dedup.put('123')
+        dedup.get(timeout=1)
+        dedup.forget(['123'])
+        self.assertTrue(dedup.put('123'))
+
+
+class TestScanStation(unittest.TestCase):
+
+    def _run(self, sources, submit, **kwargs):
+        station = ScanStation(sources, submit, window=0.05, reader_factory=_EchoReader, **kwargs)
+        station.start()
+        station.wait()
+        return station
+
+    def test_submits_distinct_barcodes_of_every_source(self):
+        submitted = []
+        sources = [_ListSource('cam0', [['1'], ['1', '2'], ['3']]), _ListSource('cam1', [['2'], ['4']])]
+        station = self._run(sources, submitted.append)
+        self.assertEqual(sorted(b_id for batch in submitted for b_id in batch), ['1', '2', '3', '4'])
+        self.assertEqual(station.submitted, 4)
+        self.assertEqual(station.queue.duplicates, 2)
+        self.assertTrue(all(source.opened and source.closed for source in sources))
+
+    def test_batches_are_at_most_max_batch(self):
+        submitted = []
+        frames = [[str(i)] for i in range(25)]
+        self._run([_ListSource('cam0', frames)], submitted.append, max_batch=10)
+        self.assertTrue(all(len(batch) <= 10 for batch in submitted))
+        self.assertEqual(sum(len(batch) for batch in submitted), 25)
+
+    def test_failed_submit_is_retried(self):
+        submitted = []
+        failures = [Exception('validator down')]
+
+        def submit(barcodes):
+            if failures:
+                raise failures.pop()
+            submitted.extend(barcodes)
+
+        # stopping right away would give the failed scans up, keep running until they made it
+        station = ScanStation([_ListSource('cam0', [['1'], ['2']])], submit, window=0.05,
+                              reader_factory=_EchoReader)
+        station.start()
+        deadline = time.time() + 10
+        while station.submitted < 2 and time.time() < deadline:
+            time.sleep(0.05)
+        station.stop()
+        self.assertEqual(sorted(submitted), ['1', '2'])
+        self.assertEqual(station.submitted, 2)
+        self.assertEqual(station.lost, 0)
+
+    def test_scans_failing_at_stop_are_given_up_and_forgotten(self):
+        def submit(barcodes):
+            raise Exception('validator down')
+
+        station = self._run([_ListSource('cam0', [['1']])], submit)
+        self.assertEqual(station.lost, 1)
+        self.assertTrue(station.queue.put('1'))